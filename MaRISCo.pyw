@@ -15,13 +15,15 @@
 
 import os;
 import sys;
-from math import exp, log;
 # Numpy
 try: import numpy as np;
 except: 
     print ("Error: NumPy library not found, see http://www.numpy.org");
     print ("       on linux simply try `yum install python-numpy`");           
     sys.exit(1);
+# simulation engine
+import marisco;
+import marisco.atlas;
 # NiBabel
 try: import nibabel as nib;
 except: 
@@ -32,7 +34,7 @@ except:
 PIL_installed=True;
 try: 
     from PIL import Image;
-    if Image.VERSION == '1.1.6':
+    if getattr(Image, 'VERSION', None) == '1.1.6': # (pillow has no VERSION)
         print("Warning: old PIL library found, upgrade recomended");      
 except: 
     print("Warning: PIL library not found, fallback to internal alternative");
@@ -65,14 +67,12 @@ try: from tkMessageBox import showerror;       # Python 2
 except: pass
 try: from tkinter.messagebox import showerror; # Python3
 except: pass
+try: from tkFileDialog import asksaveasfilename;        # Python 2
+except: pass
+try: from tkinter.filedialog import asksaveasfilename; # Python3
+except: pass
 
 
-# predefined Tissue Parameters, taken from:
-# https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2822798/
-T1_GM_def  = 1034;  T1_WM_def  = 660;   T1_CSF_def = 4000;
-T2_GM_def  = 93;    T2_WM_def  = 73;    T2_CSF_def = 2470;
-PD_GM_def  = 0.78;  PD_WM_def  = 0.65;  PD_CSF_def = 0.97;
-
 # predefined initial parameters
 TE_def = 10;
 TR_def = 200;
@@ -81,60 +81,52 @@ Slice_def = 67;
 W_def = 1.0 # default window (for intercative W/L adjust)
 L_def = 0.5 # default level  (for intercative W/L adjust)
 zoom_target = 2.5 # image zoom factor
+use_worker = True # calculate images on a background thread (if available)
+progressive = True # coarse preview while dragging, full resolution once idle
+refine_ms = 150    # idle time before the full resolution image
+volume_slab = 16   # slices per slab of the NIFTI volume export (Ctrl+S)
+heat_pair = ('GM', 'WM') # tissues of the contrast heat map (Ctrl+H)
+Sequence_def = 'SE' # SE/IR, see marisco.SEQUENCES for the others
+
+def Sequence ():
+    # name and additional parameters of the selected sequence
+    name = SEQ_tkVar.get();
+    return name, dict([(p, int(var.get())) for p, var in PAR_tkVars[name].items()]);
+
+def Update (slice,te, tr, ti, recalc_noise=True):
+    # calculate current slice (this does all the work)
+    if ReImg_tkVar.get()==0: mode='magnitude'; # Magnitude Image
+    else: mode='real';                         # Re Image: shift to positive
+    seq, params = Sequence();
+    if heatmap is not None and seq=='SE': heatmap.update(te, tr, ti, mode, TR_tkScale.cget('to'));
+    # (W/L changes only, recalc_noise=False, reuse the cached simulation)
+    if worker is not None: # calculate in the background, Display is called when done
+        worker.request(slice, te, tr, ti, mode, W, L, recalc_noise=recalc_noise, sequence=seq, params=params);
+        return
+    Display(engine.render_uint8(slice, te, tr, ti, mode, W, L, recalc_noise=recalc_noise, sequence=seq, params=params));
 
-def ATT (T1, T2, PD, TE, TR, TI):
-    # convert to flaot to avoid rounding errors
-    T1=float(T1); T2=float(T2); PD=float(PD);
-    TE=float(TE); TR=float(TR); TI=float(TI);   
-    # just for safety (negative values should never actually occur)
-    T1=abs(T1); T2=abs(T2); PD=abs(PD);
-    TE=abs(TE); TR=abs(TR); TI=abs(TI);
-    # avoid division by zero
-    if T1 == 0: T1 = sys.float_info.min;
-    if T2 == 0: T2 = sys.float_info.min;  
-    # calculate and return value
-    if TI==0: return PD * exp(-TE/T2) * (1-exp(-(TR-TE)/T1));
-    else: return PD * exp(-TE/T2) * (1-2*exp(-TI/T1)+exp(-(TR-TE)/T1));
+def Preview (slice,te, tr, ti, recalc_noise=True):
+    # coarse image from the downsampled tissues while the sliders move (see Refine)
+    if preview is None or not recalc_noise: # W/L only: the full resolution simulation is cached
+        Update(slice, te, tr, ti, recalc_noise=recalc_noise);
+        return
+    if ReImg_tkVar.get()==0: mode='magnitude'; # Magnitude Image
+    else: mode='real';                         # Re Image: shift to positive
+    seq, params = Sequence();
+    if heatmap is not None and seq=='SE': heatmap.update(te, tr, ti, mode, TR_tkScale.cget('to'));
+    if worker is not None: worker.cancel(); # an older full resolution image must not replace it
+    Display(preview.render_uint8(slice, te, tr, ti, mode, W, L, sequence=seq, params=params));
 
-def Update (slice,te, tr, ti):
-    global NoiseData
-    # calculate attenuation factors
-    GM_att  = ATT (T1_GM_def, T2_GM_def, PD_GM_def, te, tr, ti);    
-    WM_att  = ATT (T1_WM_def, T2_WM_def, PD_WM_def, te, tr, ti);    
-    CSF_att = ATT (T1_CSF_def, T2_CSF_def, PD_CSF_def, te, tr, ti);
-    # calculate current slice  
-    data =  GM_data[:,:,slice-1]*GM_att; 
-    data += WM_data[:,:,slice-1]*WM_att;
-    data += CSF_data[:,:,slice-1]*CSF_att;
-    if RecalcNoise:
-        # add some noise
-        max_ = np.amax(np.absolute(data)) + 0.1; # 0.1 is the amount of minimum hardware noise
-        NoiseData = np.random.normal(loc=0., scale=0.01*max_, size=data.shape).astype(np.float32);
-        NoiseData += np.random.normal(loc=0., scale=0.01, size=data.shape)*data.astype(np.float32);
-    data += NoiseData;
-    # Magnitude versus Real part Images (deal with negative values)   
-    if ReImg_tkVar.get()==0: data = np.absolute(data) # Magnitude Image
-    else: min_=np.amin(data); data -= min_; # Re Image: shift to positive
-    # normalization    
-    max_=np.amax(data);
-    if max_>0: data /= max_;
-    # W/L
-    # default values are W=1.0; L=0.5
-    data = (data-L)/W+0.5 # now we have values <0 and >1
-    mask0 = data>0.0; data *= mask0; # solved <0
-    mask1 = data<=1.0;
-    mask1a = data>1.0
-    data = data*mask1 + mask1a.astype(int);
-    # scaling (max 256 !)
-    data *= 220.;
+def Refine (slice,te, tr, ti, recalc_noise=True):
+    # full resolution with fresh noise, once no slider moved for refine_ms
+    if recalc_noise: Update(slice, te, tr, ti, recalc_noise=True);
+
+def Display (data):
     # display image
-    if PIL_installed:
-        if Image.VERSION != '1.1.6': # if not bad version go
-            imageA = Image.fromarray(data.swapaxes(0, 1)) ;
-            imageA = imageA.resize ([zoom_X,zoom_Y], resample=Image.BICUBIC);
-            imageTk=ImageTk.PhotoImage(imageA);
-        else: imageTk=tk.PhotoImage(data=make_img(NN_zoom(data,zoom_X,zoom_Y))); # PIL fallback
-    else: imageTk=tk.PhotoImage(data=make_img(NN_zoom(data,zoom_X,zoom_Y))); # PIL fallback
+    if display is not None: # PIL: one PhotoImage, updated in place (see marisco/display.py)
+        display.show_data(data);
+        return
+    imageTk=tk.PhotoImage(data=marisco.pgm(marisco.nn_zoom(data,zoom_X,zoom_Y))); # PIL fallback
     IMG_tkLabel.configure(image=imageTk); # image redisplaying
     IMG_tkLabel.image = imageTk;          # keep a reference!
     #print("Slice=%d  -  TE=%d - TR=%d - TI=%d" % (slice, te, tr, ti); # debug
@@ -156,7 +148,7 @@ def validateTE (TE):
         TR=TI+TE;               # correct local TR
         TR_tkVar.set(TR);       # correct TR in GUI
     RecalcNoise=True;
-    Update(SL,TE, TR, TI);      # update
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
     TE_tkScale.focus();
 
 def validateTR (TR):
@@ -174,8 +166,8 @@ def validateTR (TR):
     if TR<TI+TE and TI>0:       # TR<TI+TE is wrong py MR pysics
         TI=TR-TE;               # correct local TI
         TI_tkVar.set(TI);       # correct TI in GUI
-    Update(SL,TE, TR, TI);      # update
     RecalcNoise=True;
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
     TR_tkScale.focus();
     
 def validateTI (TI):
@@ -202,7 +194,7 @@ def validateTI (TI):
         TR=TI+TE;               # correct local TR
         TR_tkVar.set(TR);       # correct TI in GUI
     RecalcNoise=True;
-    Update(SL,TE, TR, TI);      # update
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
     TI_tkScale.focus();    
   
 def validateSL (SL):
@@ -212,9 +204,35 @@ def validateSL (SL):
     TR = int(TR_tkVar.get());   # get TR
     TI = int(TI_tkVar.get());   # get TI
     RecalcNoise=True;
-    Update(SL,TE, TR, TI);      # update
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
     SL_tkScale.focus();
 
+def validatePAR (value):       # sliders of the sequence parameters (flip angle, ...)
+    global RecalcNoise;
+    TE = int(TE_tkVar.get());   # get TE
+    TR = int(TR_tkVar.get());   # get TR
+    TI = int(TI_tkVar.get());   # get TI
+    SL = int(SL_tkVar.get());   # get SL
+    RecalcNoise=True;
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
+
+def validateSEQ (name):         # sequence selected
+    seq = marisco.SEQUENCES[name];
+    for other in PAR_tkRows:    # only the sliders of this sequence
+        for label, scale in PAR_tkRows[other]:
+            if other==name: label.grid(); scale.grid();
+            else: label.grid_remove(); scale.grid_remove();
+    if 'TE' in seq.uses:
+        TE_tkScale.configure(state='normal', fg='black', troughcolor=ltgray);
+        TE_tkLabel.configure(text=seq.uses['TE']+' ');
+    else:
+        TE_tkScale.configure(state='disabled', fg=sysbg, troughcolor=sysbg);
+        TE_tkLabel.configure(text='');
+    if 'TI' not in seq.uses and int(TI_tkVar.get())>0:
+        TI_tkVar.set(0); validateTI(0); # spin echo look of the TR/TI sliders
+    TI_tkScale.configure(state='normal' if 'TI' in seq.uses else 'disabled');
+    validatePAR(0);
+
 def validateRE ():              # just a wrapper
     global RecalcNoise;
     TE = int(TE_tkVar.get());   # get TE
@@ -222,7 +240,35 @@ def validateRE ():              # just a wrapper
     TI = int(TI_tkVar.get());   # get TI
     SL = int(SL_tkVar.get());   # get SL
     RecalcNoise=False;
-    Update(SL,TE, TR, TI);      # update
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update when idle
+
+def SaveVolume (event=None):
+    # simulate all slices of the current protocol into a NIFTI file (Ctrl+S)
+    if getattr(marisco.volume, 'nib', None) is None:
+        showerror(Program_name,' Saving volumes requires NiBabel         '); return
+    TE = int(TE_tkVar.get()); TR = int(TR_tkVar.get()); TI = int(TI_tkVar.get());
+    if ReImg_tkVar.get()==0: mode='magnitude'; # Magnitude Image
+    else: mode='real';                         # Re Image: shift to positive
+    filename = asksaveasfilename(defaultextension='.nii', filetypes=[('NIFTI', '.nii')],
+        initialfile='TE%d_TR%d_TI%d.nii' % (TE, TR, TI));
+    if not filename: return
+    def progress(done, total): # slice count in the title, the GUI is busy meanwhile
+        root.title('%s  %d/%d' % (Program_name[:Program_name.find('.')], done, total)); root.update_idletasks();
+    root.config(cursor='watch'); root.update_idletasks();
+    seq, params = Sequence();
+    try: marisco.simulate_volume(marisco.SimulationEngine(source), filename, TE, TR, TI, mode, volume_slab,
+             progress=progress, sequence=seq, params=params);
+    except (IOError, OSError) as e: showerror(Program_name, ' %s ' % e);
+    root.config(cursor=''); root.title(Program_name[:Program_name.find('.')]);
+
+def NullTissue (event=None, name='CSF'):
+    # inversion time nulling a tissue (CSF) at the current TE/TR (Ctrl+N)
+    if Sequence()[0]!='SE': return; # inversion recovery only
+    TE = int(TE_tkVar.get()); TR = int(TR_tkVar.get());
+    T1 = marisco.optimizer.tissue(engine.tissues, name)[0];
+    TI = max(1, int(round(float(marisco.null_ti(T1, TE, TR))))); # TR>=TI+TE holds
+    TI_tkVar.set(TI);
+    validateTI(TI);
 
 def mouse_left_click(event): # to reset W/L 
     global W, L;             # to pass values after reset to "def Update" 
@@ -262,41 +308,6 @@ def mouse_right_move(event): # read motion relative to initial position
     #if W<step_x: W=step_x
     validateRE ();
 
-def make_img (data):
-    # converts a 2D numpy float array into an image for tk.PhotoImage
-    # tk.PhotoImage is the plain vanilla tkinter implementation
-    # PIL.ImageTk.PhotoImage is what we are actually using
-    # leave the code as fallback , in case PIL does not work 
-    x=data.shape[0]
-    y=data.shape[1]
-    min_=np.amin(data); data -= min_ # shift to min = 0
-    max_=np.amax(data);
-    if max_>0: data /= max_; # normalize to 1
-    data *= 191 #191 is max for tk.PhotoImage, PIL can deal with 254 (255?)
-    data_int = data.astype(np.int32).swapaxes(0, 1).flatten()
-    data_str = "".join([chr(item) for item in data_int])
-    header_str = "P5 "+str(x)+" "+str(y)+" 255 "
-    return header_str+data_str
-
-def NN_zoom (inp,x,y): 
-    # simple 2D implementation for Nearest Neighbour interpolation
-    # drop-in replacement for PIL.Image.resize
-    # fallback in case PIL fails to import (if PIL_installed = False)
-    # PIL is faster, and has a bicubic interpolation
-    scale_x = x/float(inp.shape[0]); scale_y = y/float(inp.shape[1]);
-    tmp = np.zeros([x,inp.shape[1]], dtype=type(inp[0,0]));
-    for i in range (0,x): tmp[i,:]=inp[int(i/scale_x),:];
-    out = np.zeros([x,y], dtype=type(inp[0,0]));
-    for j in range (0,y): out[:,j]=tmp[:,int(j/scale_y)];
-    return out
-    # tought the following would be faster
-    # but its actually ~50% slower
-    ##scale_x = x/float(inp.shape[0]); scale_y = y/float(inp.shape[1]);
-    ##ix = np.zeros(x, dtype=int); iy = np.zeros(y, dtype=int);
-    ##for i in range (0,x): ix[i]=int(i/scale_x);
-    ##for j in range (0,y): iy[j]=int(j/scale_y);
-    ##return inp[np.ix_(ix,iy)] # 
-    
 # ========================= MAIN PROGRAM STARTS HERE =========================
 
 # initialize tk
@@ -314,68 +325,33 @@ except: # in plain python this is where the script was run from
     resourcedir = os.path.abspath(os.path.dirname(sys.argv[0]))+slash; 
 
 try: # try reading input file from NIFTI's
-    # extract infos from GM
-    GM_image = nib.load(resourcedir+'GM.nii.gz');
-    data_pixdim = GM_image.get_header().get_zooms()
-    GM_data = GM_image.get_data();
-    data_dim = GM_data.shape
-    total_slices = data_dim[2];
-    zoom_X=int(data_dim[0]*data_pixdim[0]*zoom_target); # enlarge x 2.5 (used in Update)
-    zoom_Y=int(data_dim[1]*data_pixdim[1]*zoom_target); # enlarge x 2.5 (used in Update) 
-    # read WM, CSF   
-    WM_data = nib.load(resourcedir+'WM.nii.gz').get_data();
-    CSF_data = nib.load(resourcedir+'CSF.nii.gz').get_data();
-    # reformat data
-    GM_data  = GM_data [:,::-1,::-1]; # flip AP and reverse slice order
-    WM_data  = WM_data [:,::-1,::-1]; # flip AP and reverse slice order
-    CSF_data = CSF_data [:,::-1,::-1];# flip AP and reverse slice order
+    source = marisco.NiftiSource(resourcedir); # lazy, slices read on demand until cached
+    source = marisco.CachedSource(source);     # decoded slices, prefetched
 except:
     try: # try reading input file from RGB tif
-        # extract infos  
-        img = Image.open(resourcedir+'RGB.tif');
-        try:
-            IMAGEWIDTH   = img.tag.tags[256][0];
-            IMAGELENGTH  = img.tag.tags[257][0];
-        except:
-            IMAGEWIDTH, IMAGELENGTH = img.size
-        try:
-            x_resolution = img.tag.tags[282];  # in DPI
-            y_resolution = img.tag.tags[283];  # in DPI
-            pixdim_x = float(x_resolution[0][1])/float(x_resolution[0][0]);
-            pixdim_y = float(y_resolution[0][1])/float(y_resolution[0][0]);
-        except: 
-            pixdim_x, pixdim_y = img.info['resolution']
-            pixdim_x = 1/pixdim_x
-            pixdim_y = 1/pixdim_y
-        # read data
-        all_data = np.array(img)[..., np.newaxis];
-        error=False; i=0;
-        while not error:
-          try:
-            i += 1;
-            img.seek(i);
-            all_data = np.append(all_data, np.atleast_3d(np.array(img)[..., np.newaxis]), axis=3);
-          except:
-            error=True;
-        GM_data  = all_data.astype(np.float32)[:,:,1,:]/255.;
-        WM_data  = all_data.astype(np.float32)[:,:,2,:]/255.;
-        CSF_data = all_data.astype(np.float32)[:,:,0,:]/255.;
-        # reformat data
-        GM_data = np.swapaxes(GM_data, 0, 1);   # swap RL-AP
-        WM_data = np.swapaxes(WM_data, 0, 1);   # swap RL-AP
-        CSF_data = np.swapaxes(CSF_data, 0, 1); # swap RL-AP        
-        GM_data  = GM_data [:,:,::-1];          # reverse slice order
-        WM_data  = WM_data [:,:,::-1];          # reverse slice order
-        CSF_data = CSF_data [:,:,::-1];         # reverse slice order
-        # calculate parameters from extracted infos 
-        total_slices = all_data.shape[3];
-        zoom_X=int(CSF_data.shape[0]*pixdim_x*zoom_target); # enlarge x 2.5 (used in Update)
-        zoom_Y=int(CSF_data.shape[1]*pixdim_y*zoom_target); # enlarge y 2.5 (used in Update)
+        source = marisco.TiffSource(resourcedir+'RGB.tif');
     except: 
         root.withdraw(); 
         showerror(Program_name,' Error loading Image file(s)         ');
         sys.exit(1); 
         # you may also come here if the TIF file is OK, but PIL is not installed to read it
+# attenuation lookup tables of the slider grid, memory-mapped (written once to the user cache)
+atlas = marisco.atlas.AttenuationAtlas(source.tissues, marisco.atlas.atlas_file(source.tissues));
+engine = marisco.SimulationEngine(source, atlas=atlas); # the simulation behind the GUI
+preview = None
+if progressive: # 2x/4x downsampled tissues for the previews while dragging
+    factor = marisco.preview_factor(source.width, source.height);
+    preview = marisco.SimulationEngine(marisco.PyramidSource(source, factor), atlas=atlas);
+# renders only the latest slider/mouse state, refined once idle
+if preview is not None: scheduler = marisco.RenderScheduler(root, Preview, Refine, refine_ms);
+else: scheduler = marisco.RenderScheduler(root, Update);
+worker = None
+if use_worker:
+    try: worker = marisco.RenderWorker(root, engine.render_uint8, Display);
+    except ImportError: pass # no threading, calculate in the Tk main loop
+total_slices = source.total_slices;
+zoom_X=int(source.width*source.pixdim[0]*zoom_target);  # enlarge x 2.5 (used in Update)
+zoom_Y=int(source.height*source.pixdim[1]*zoom_target); # enlarge y 2.5 (used in Update)
 
 
 # variable Definition & Initialize
@@ -386,9 +362,15 @@ TR_tkVar = tk.IntVar(); TR_tkVar.set(TR_def);
 TI_tkVar = tk.IntVar(); TI_tkVar.set(TI_def);
 ReImg_tkVar = tk.IntVar(); ReImg_tkVar.set(0);
 RecalcNoise = True # RecalcNoiseulated image, if not only W/L update
-NoiseData   = 0    # initial definiton of global variable
 # Image placeholder
 IMG_tkLabel=tk.Label(text='init');
+display = None
+if PIL_installed and getattr(Image, 'VERSION', None) != '1.1.6': # if not bad version go
+    display = marisco.ImageDisplay(IMG_tkLabel, source.width, source.height, (zoom_X,zoom_Y));
+heatmap = None # contrast heat map window, follows the sliders (see marisco/heatmap.py)
+if display is not None:
+    import marisco.heatmap;
+    heatmap = marisco.heatmap.HeatMapView(root, atlas, heat_pair[0], heat_pair[1]);
 # tk.Scale slider for TE 
 TE_tkScale = tk.Scale(root, command=validateTE, variable=TE_tkVar, 
     from_=0, to=250, tickinterval=25, resolution=1, 
@@ -415,6 +397,25 @@ SL_tkScale = tk.Scale(root, command=validateSL, variable=SL_tkVar,
     fg='black', troughcolor=ltgray, highlightcolor=sysbg,
     length=zoom_Y-16, showvalue='no', orient='vertical');
 SL_tkLabel  = tk.Label(root, font=('Helvetica', 8), textvariable=SL_tkVar);
+# sequence selection, plus one slider per additional parameter of each sequence
+SEQ_tkVar = tk.StringVar(); SEQ_tkVar.set(Sequence_def);
+SEQ_tkMenu = tk.OptionMenu(root, SEQ_tkVar, *marisco.SEQUENCES.keys(), command=validateSEQ);
+SEQ_tkMenu.configure(font=('Helvetica', 8), highlightthickness=0);
+PAR_tkVars = {}; PAR_tkRows = {};
+row = 6;
+for name, seq in marisco.SEQUENCES.items():
+    PAR_tkVars[name] = {}; PAR_tkRows[name] = [];
+    for param, text, from_, to, resolution, default in seq.params:
+        var = tk.IntVar(); var.set(default);
+        scale = tk.Scale(root, command=validatePAR, variable=var,
+            from_=from_, to=to, resolution=resolution, tickinterval=(to-from_)//5 or 1,
+            fg='black', troughcolor=ltgray, highlightcolor=sysbg, font=('Helvetica', 8),
+            length=zoom_X, showvalue='yes', orient='horizontal');
+        label = tk.Label(root, text=text+' ');
+        label.grid(row=row, column=0, sticky="W"); scale.grid(row=row, column=1, columnspan=2, sticky="E");
+        if name!=Sequence_def: label.grid_remove(); scale.grid_remove();
+        PAR_tkVars[name][param] = var; PAR_tkRows[name].append((label, scale));
+        row += 1;
 # Layout
 # ---------------------------------------
 # | Slice number |   Image   |    <     |
@@ -422,6 +423,8 @@ SL_tkLabel  = tk.Label(root, font=('Helvetica', 8), textvariable=SL_tkVar);
 # |     TE label | TE slider |    <     |
 # |     TR label | TR slider |    <     |
 # |     TT label | TI slider | ReImggBox |
+# | Sequence     |           |          |
+# |  param label | param slider (of the selected sequence)
 # ---------------------------------------
 SL_tkLabel.grid (row=0, column=0);             # Slice number 
 SL_tkScale.grid (row=1, column=0, sticky="W"); # Slice slider
@@ -433,10 +436,14 @@ TR_tkScale.grid (row=3, column=1, columnspan=2, sticky="E"); # TR slider
 TI_tkLabel.grid (row=4, column=0, sticky="W"); # TI label
 TI_tkScale.grid (row=4, column=1, sticky="W"); # TI slider
 ReImg_tkBox.grid(row=4, column=2, sticky="W"); # Realpart Image checkBox
+SEQ_tkMenu.grid (row=5, column=0, columnspan=2, sticky="W"); # Sequence menu
 # this could be used for window/leveling (not actually implemented)
 IMG_tkLabel.bind("<Button-1>",  mouse_left_click)
 IMG_tkLabel.bind("<Button-3>",  mouse_right_click)
 IMG_tkLabel.bind("<B3-Motion>", mouse_right_move)
+root.bind("<Control-s>", SaveVolume) # whole volume of the current protocol as NIFTI
+root.bind("<Control-n>", NullTissue) # null CSF: TI for the current TE/TR
+if heatmap is not None: root.bind("<Control-h>", heatmap.toggle); # contrast heat map window
 # update and go ...
 Update(int(SL_tkVar.get()), int(TE_tkVar.get()), int(TR_tkVar.get()), int(TI_tkVar.get()));
 
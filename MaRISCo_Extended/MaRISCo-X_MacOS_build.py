@@ -8,6 +8,7 @@ import shutil
 from setuptools import setup
 
 sys.argv.append('py2app')
+sys.path.insert(0, os.path.abspath('..')) # marisco engine package
 
 APP = ['MaRISCo-X.py']
 DATA_FILES = ['RGBA.tif']
@@ -1,6 +1,7 @@
 # -*- mode: python -*-
 a = Analysis(['MaRISCo-X.py'],
-             excludes=[ 'win32pdh','win32pipe',
+             pathex=['..'], # marisco engine package
+             excludes=[ 'win32pdh','win32pipe', 'numpy', 'nibabel',
                         'multiprocessing', 'ctypes', 'socket', 'bz2',
                         'select', 'pydoc', 'pickle', '_hashlib', '_ssl',
                         'setuptools', 'pyexpat', 'unicodedata', '_bsddb',
@@ -18,14 +18,11 @@
 
 import os;
 import sys;
-import random
 import time;
-from math import exp;
-from operator import add, mul, abs;
 # Python Imaging Library (PIL), alternative "pillow"
 try: 
     from PIL import Image;
-    if Image.VERSION == '1.1.6':
+    if getattr(Image, 'VERSION', None) == '1.1.6': # (pillow has no VERSION)
         print("Warning: old PIL library found, upgrade recomended");   
 except: 
     print("Error: PIL library not found, fallback to internal alternative");
@@ -58,15 +55,13 @@ try: from tkMessageBox import showerror;       # Python 2
 except: pass
 try: from tkinter.messagebox import showerror; # Python3
 except: pass
+# simulation engine (one folder up, unless bundled by PyInstaller/py2app)
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), '..'));
+import marisco;
+import marisco.atlas;
 
 # =============================== CONSTANTS ==================================
 
-# predefined Tissue Parameters, taken from:
-# https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2822798/
-T1_GM_def  = 1034;  T1_WM_def  = 660;   T1_CSF_def = 4000;
-T2_GM_def  = 93;    T2_WM_def  = 73;    T2_CSF_def = 2470;
-PD_GM_def  = 0.78;  PD_WM_def  = 0.65;  PD_CSF_def = 0.97;
-
 # predefined initial parameters
 TE_def = 10;    # default echo time
 TR_def = 200;   # default repetition time
@@ -75,84 +70,51 @@ Slice_def = 67; # default slice location
 W_def = 1.0     # default window (for intercative W/L adjust)
 L_def = 0.5     # default level  (for intercative W/L adjust)
 zoom_target=2.5 # image zoom factor (relative to 1mm resolution)
+use_worker=True # calculate images on a background thread (if available)
+progressive=True # coarse preview while dragging, full resolution once idle (NumPy)
+refine_ms=150   # idle time before the full resolution image
+cache_MB=256    # memory cap of the slice cache (MB)
+hover_ms=16     # hover info updates at most every hover_ms (display rate)
+PERCENT = ["%4.1f" % (v/2.55) for v in range(0, 256)]; PERCENT[255] = " 100"; # uint8 fractions formatted
 
 # ========================= SUBROUTINE DEFINITIONS ===========================
 
-def calcATT (T1, T2, PD, TE, TR, TI):
-    # convert to flaot to avoid rounding errors
-    T1=float(T1); T2=float(T2); PD=float(PD);
-    TE=float(TE); TR=float(TR); TI=float(TI);
-    # calculate and return value
-    if TI==0: return PD * exp(-TE/T2) * (1-exp(-(TR-TE)/T1));
-    else: return PD * exp(-TE/T2) * (1-2*exp(-TI/T1)+exp(-(TR-TE)/T1));
-
-def calcImg (slice,te, tr, ti):
-    global NoiseData, last_slice, data, data_raw, data_CSF_raw, data_GM_raw, data_WM_raw
-    # calculate attenuation factors (255. is the max intensity in the import image)
-    GM_att  = calcATT (T1_GM_def, T2_GM_def, PD_GM_def, te, tr, ti)/255.;    
-    WM_att  = calcATT (T1_WM_def, T2_WM_def, PD_WM_def, te, tr, ti)/255.;    
-    CSF_att = calcATT (T1_CSF_def, T2_CSF_def, PD_CSF_def, te, tr, ti)/255.;
-    if slice != last_slice:
-        img.seek(total_slices-slice);               # slicenumber
-        img_CSF, img_GM, img_WM = img.split()       # sepatate tissues
-        img_CSF = img_CSF.convert(mode='F')         # convert CSF image to mode float
-        img_GM = img_GM.convert(mode='F')           # convert GM  image to mode float
-        img_WM = img_WM.convert(mode='F')           # convert WM  image to mode float
-        data_CSF_raw = list(img_CSF.getdata());     # convert to list 
-        data_GM_raw  = list(img_GM.getdata());      # convert to list 
-        data_WM_raw  = list(img_WM.getdata());      # convert to list      
-        last_slice = slice
-    # calculate new image
-    data_CSF = [f * CSF_att for f in data_CSF_raw]; # normalize to 1.0 and multiply with ATT
-    data_GM  = [f * GM_att for f in data_GM_raw];   # normalize to 1.0 and multiply with ATT
-    data_WM  = [f * WM_att for f in data_WM_raw];   # normalize to 1.0 and multiply with ATT
-    data_raw = map(add, data_CSF, data_GM); data_raw = map(add, data_raw, data_WM) # add
-    data = data_raw
-    if RecalcNoise:
-        # add some noise
-        min_= min (data); max_= max (data)
-        n_level1 = max ([abs(max_), abs(min_)])
-        n_level1 += 0.1  # amount of minimum hardware noise
-        n_level1 *= 0.01 # amount of noise that scales linear with normalization (attenuator)
-        n_level2 = 0.01  # simple model for physiological noise
-        random.shuffle(Noise_Ref); 
-        # sumation of the levels referencing to a single noise source is not strictly correct
-        # correct would be referencing separate noise sources each with its own level, then sum
-        # this would sum the noise levels in an incorrent way
-        # the way it stands below noise sources are addad coherently, results are sligtly larger
-        # but this is WAY faster
-        NoiseData = map(mul, [n_level1+n_level2*abs(f) for f in data], Noise_Ref); #fastest
-    data = map(add, data, NoiseData) # add noise
-    # Magnitude versus Real part Images (deal with negative values)   
-    if ReImg_tkVar.get()==0: data = [abs(f) for f in data] # Magnitude Image
-    else: min_= min (data); data = [f-min_ for f in data]; # Re Image: shift to positive
-    # normalization, WL, scaling to 220 --> all in one for speed (initial values W=1.0; L=0.5)
-    normalization=max(data);
-    if normalization == 0: normalization=sys.float_info.min;
-    data = [((f/normalization-L)/W+0.5)*220. for f in data];
-    data = [0 if f<0 else f for f in data];
-    data = [220. if f>220. else f for f in data];
-    return data;
+def calcImg (slice,te, tr, ti, recalc_noise=True, background=False):
+    if ReImg_tkVar.get()==0: mode='magnitude'; # Magnitude Image
+    else: mode='real';                         # Re Image: shift to positive
+    if background: # the worker thread must not touch Tk, everything is read here
+        worker.request(slice, te, tr, ti, mode, W, L, recalc_noise=recalc_noise); return;
+    if worker is not None: # direct call (START), wait for a running background calculation
+        with worker.lock: return engine.render_uint8(slice, te, tr, ti, mode, W, L, recalc_noise=recalc_noise);
+    return engine.render_uint8(slice, te, tr, ti, mode, W, L, recalc_noise=recalc_noise);
       
-def UpdateImg (slice,te, tr, ti):
-    data = calcImg(slice,te, tr, ti); # this does all the work
+def UpdateImg (slice,te, tr, ti, recalc_noise=True):
+    if worker is not None: # calculate in the background, ShowImg is called when done
+        calcImg(slice,te, tr, ti, recalc_noise, background=True); return;
+    ShowImg(calcImg(slice,te, tr, ti, recalc_noise)); # this does all the work
+
+def PreviewImg (slice,te, tr, ti, recalc_noise=True):
+    # coarse image from the downsampled tissues while the sliders move (see RefineImg)
+    if preview is None or not recalc_noise: # W/L only: the full resolution simulation is cached
+        UpdateImg(slice,te, tr, ti, recalc_noise); return;
+    if ReImg_tkVar.get()==0: mode='magnitude'; # Magnitude Image
+    else: mode='real';                         # Re Image: shift to positive
+    if worker is not None: worker.cancel(); # an older full resolution image must not replace it
+    ShowImg(preview.render_uint8(slice, te, tr, ti, mode, W, L));
+
+def RefineImg (slice,te, tr, ti, recalc_noise=True):
+    # full resolution with fresh noise, once no slider moved for refine_ms
+    if recalc_noise: UpdateImg(slice,te, tr, ti, True);
+
+def ShowImg (data):
+    # one PhotoImage, updated in place (see marisco/display.py)
     if Start<=1:             # not yet started
         if Start==1: return; # inside start animation
-        im = img.resize ([zoom_X,zoom_Y], resample=Image.BICUBIC);
-        try: 
-            imageTk=ImageTk.PhotoImage(im);
-            IMG_tkLabel.configure(image=imageTk); # image redisplaying    
-            IMG_tkLabel.image = imageTk;          # keep a reference!
+        try: display.show(source.page(SL_tkVar.get()).resize(display.size, resample=Image.BICUBIC));
         except: pass # may happen when missing python-imaging-tk
         return
-    # display image
-    im = Image.new('F', (IMAGEWIDTH, IMAGELENGTH))
-    im.putdata(data)
-    im = im.resize ([zoom_X,zoom_Y], resample=Image.BICUBIC);
-    try:
-        imageTk=ImageTk.PhotoImage(im);
-        IMG_tkLabel.configure(image=imageTk); # image redisplaying
-        IMG_tkLabel.image = imageTk;          # keep a reference!
+    # display image (8 bit, resized in mode 'L')
+    try: display.show_data(data);
     except: pass # may happen when missing python-imaging-tk
 
 def validateTE (TE):
@@ -171,7 +133,7 @@ def validateTE (TE):
         TR=TI+TE;               # correct local TR
         TR_tkVar.set(TR);       # correct TR in GUI
     RecalcNoise=True;
-    UpdateImg(SL,TE, TR, TI);   # update image
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update image when idle
     TE_tkScale.focus();
 
 def validateTR (TR):
@@ -189,8 +151,8 @@ def validateTR (TR):
     if TR<TI+TE and TI>0:       # TR<TI+TE is wrong py MR pysics
         TI=TR-TE;               # correct local TI
         TI_tkVar.set(TI);       # correct TI in GUI
-    UpdateImg(SL,TE, TR, TI);   # update image
     RecalcNoise=True;
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update image when idle
     TR_tkScale.focus();
     
 def validateTI (TI):
@@ -217,7 +179,7 @@ def validateTI (TI):
         TR=TI+TE;               # correct local TR
         TR_tkVar.set(TR);       # correct TI in GUI
     RecalcNoise=True;
-    UpdateImg(SL,TE, TR, TI);   # update image
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update image when idle
     TI_tkScale.focus();    
   
 def validateSL (SL):
@@ -227,7 +189,7 @@ def validateSL (SL):
     TR = int(TR_tkVar.get());   # get TR
     TI = int(TI_tkVar.get());   # get TI
     RecalcNoise=True;
-    UpdateImg(SL,TE, TR, TI);   # update image
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update image when idle
     SL_tkScale.focus();
 
 def validateRE ():              # just a wrapper
@@ -237,7 +199,7 @@ def validateRE ():              # just a wrapper
     TI = int(TI_tkVar.get());   # get TI
     SL = int(SL_tkVar.get());   # get SL
     RecalcNoise=False;
-    UpdateImg(SL,TE, TR, TI);   # update image
+    scheduler.request(SL,TE, TR, TI, recalc_noise=RecalcNoise); # update image when idle
 
 def mouse_left_click(event): # to reset W/L 
     global W, L;             # to pass values after reset to "def updateImg"
@@ -265,25 +227,24 @@ def mouse_right_move(event): # read motion relative to initial position
     if W<=0: W=1e-10; # required to avoid division by zero
     validateRE ();
 
-def image_motion(event): # to reset W/L
-    x=int(event.x); y=int(event.y); 
-    x_str = str(x); blanks = ' '*max(4-len(x_str),1); x_str += blanks;
-    y_str = str(y); blanks = ' '*max(4-len(y_str),1); y_str += blanks;
+def image_motion(event): # hover info, shown at most at the display rate (see ShowInfo)
+    hover.request(SL_tkVar.get(), int(event.x), int(event.y));
+
+def ShowInfo(slice, x, y):
     x_raw=int(x/pixdim_x/zoom_target);
     y_raw=int(y/pixdim_y/zoom_target);
-    s=data_raw[x_raw+y_raw*IMAGEWIDTH];
-    wm=data_WM_raw[x_raw+y_raw*IMAGEWIDTH]/255.*100; wm_str = ("%4.1f" %wm);
-    if wm_str=="100.0": wm_str=" 100";
-    gm=data_GM_raw[x_raw+y_raw*IMAGEWIDTH]/255.*100; gm_str = ("%4.1f" %gm);
-    if gm_str=="100.0": gm_str=" 100";
-    csf=data_CSF_raw[x_raw+y_raw*IMAGEWIDTH]/255.*100; csf_str = ("%4.1f" %csf);
-    if csf_str=="100.0": csf_str=" 100";  
+    if x_raw>=IMAGEWIDTH or y_raw>=IMAGELENGTH: return;
+    x_str = str(x); blanks = ' '*max(4-len(x_str),1); x_str += blanks;
+    y_str = str(y); blanks = ' '*max(4-len(y_str),1); y_str += blanks;
+    p = engine.probe(slice, x_raw, y_raw); # tissue fractions and signal (see marisco/engine.py)
+    wm_str, gm_str, csf_str = [PERCENT[int(p[t]*255+0.5)] for t in ('WM','GM','CSF')];
     text = " X=%sY=%s WM/GM/CSF =%s/%s/%s%%" % (x_str, y_str, wm_str, gm_str, csf_str)
-    if Start>0: # doesn't make sense to display signal before
-        text += "   Signal=%.2f" % (s)
+    if Start>0 and p['signal'] is not None: # doesn't make sense to display signal before
+        text += "   Signal=%.2f" % (p['signal'])
     INF_tkVar.set(text);
     
 def image_leave(event): # to reset W/L   
+    hover.cancel();
     INF_tkVar.set('');  
        
 def START(event):
@@ -291,29 +252,22 @@ def START(event):
     Start=1;
     START_tkText.grid_forget();
     root.update(); # update GUI
-    # get startup RGB image
+    # both endpoints are calculated and resized once, the steps only blend
+    im1 = source.page(SL_tkVar.get()).resize ([zoom_X,zoom_Y], resample=Image.BICUBIC); # startup RGB image
+    data = calcImg(SL_tkVar.get(),TE_tkVar.get(), TR_tkVar.get(), TI_tkVar.get(), RecalcNoise);
+    im2 = display.image(data).convert(mode='RGB'); # grayscale image
+    RecalcNoise = False;
     steps=20;
     for i in range (0, steps):     
-        # calc grayscale image for blending
-        im2 = Image.new('F', (IMAGEWIDTH, IMAGELENGTH));
-        data = calcImg(SL_tkVar.get(),TE_tkVar.get(), TR_tkVar.get(), TI_tkVar.get());
-        im2.putdata(data);
-        im2 = im2.resize ([zoom_X,zoom_Y], resample=Image.BICUBIC);
-        im2 = im2.convert(mode='RGB');
-        RecalcNoise = False;
-        # get RGB image for blending
-        im1 = img.resize ([zoom_X,zoom_Y], resample=Image.BICUBIC);        
         # animation
         try: root.winfo_exists()
         except: sys.exit(1); # somebody killed the app ;)
-        imageTk=ImageTk.PhotoImage(Image.blend(im1,im2,(i+1)/float(steps)));
-        IMG_tkLabel.configure(image=imageTk); # image redisplaying
+        display.show(Image.blend(im1,im2,(i+1)/float(steps)));
         IMG_tkLabel.update_idletasks();       # update GUI
-        IMG_tkLabel.image = imageTk;          # keep a reference!
         root.update(); #root.update_idletasks();        
         time.sleep(0.005);   
     Start=2;   
-    UpdateImg(SL_tkVar.get(),TE_tkVar.get(), TR_tkVar.get(), TI_tkVar.get()); # update image
+    UpdateImg(SL_tkVar.get(),TE_tkVar.get(), TR_tkVar.get(), TI_tkVar.get(), False); # update image, the noise of the last animation frame
 
 # ========================= MAIN PROGRAM STARTS HERE =========================
 
@@ -334,28 +288,11 @@ except: # in plain python this is where the script was run from
     
 # read input file
 try: 
-    # extract infos  
-    img = Image.open(resourcedir+'RGB.tif');
-    img.load() # required to be able to split R/G/B=CSF/GM/WM
-    try: # prefer to read directly the TIF tags
-        IMAGEWIDTH   = img.tag.tags[256][0];
-        IMAGELENGTH  = img.tag.tags[257][0];
-    except: # if not present (depends on PIL/pillow implementation)
-        IMAGEWIDTH, IMAGELENGTH = img.size
-    try: # prefer to read directly the TIF tags
-        x_resolution = img.tag.tags[282];  # in DPI
-        y_resolution = img.tag.tags[283];  # in DPI
-        pixdim_x = float(x_resolution[0][1])/float(x_resolution[0][0]);
-        pixdim_y = float(y_resolution[0][1])/float(y_resolution[0][0]);
-    except: # if not present (depends on PIL/pillow implementation)
-        pixdim_x, pixdim_y = img.info['resolution']
-        pixdim_x = 1/pixdim_x
-        pixdim_y = 1/pixdim_y
-    # calculate parameters from extracted infos 
-    total_slices = 0
-    while True:
-        try: img.seek(total_slices); total_slices += 1
-        except EOFError: break; 
+    source = marisco.PilSource(resourcedir+'RGB.tif'); # R/G/B=CSF/GM/WM
+    source = marisco.CachedSource(source, max_bytes=cache_MB*2**20); # decoded slices, prefetched
+    IMAGEWIDTH = source.width; IMAGELENGTH = source.height;
+    pixdim_x, pixdim_y = source.pixdim;
+    total_slices = source.total_slices;
     zoom_X=int(IMAGEWIDTH*pixdim_x*zoom_target); # enlarge x 2.5 (used in updateImg)
     zoom_Y=int(IMAGELENGTH*pixdim_y*zoom_target); # enlarge y 2.5 (used in updateImg)
 except: 
@@ -363,23 +300,36 @@ except:
     showerror(Program_name,' Error loading Image file(s)         ');
     sys.exit(1); 
     # you may also come here if the TIF file is OK, but PIL is not installed to read it
+engine = marisco.SimulationEngine(source); # the simulation behind the GUI
+preview = None
+if progressive and engine.backend == 'numpy': # 2x/4x downsampled tissues for the previews while dragging
+    factor = marisco.preview_factor(IMAGEWIDTH, IMAGELENGTH);
+    preview = marisco.SimulationEngine(marisco.PyramidSource(source, factor));
+if engine.backend == 'numpy': # attenuation by table lookups on the slider grid
+    engine.atlas = marisco.atlas.AttenuationAtlas(source.tissues);
+    if preview is not None: preview.atlas = engine.atlas;
+# renders only the latest slider/mouse state, refined once idle
+if preview is not None: scheduler = marisco.RenderScheduler(root, PreviewImg, RefineImg, refine_ms);
+else: scheduler = marisco.RenderScheduler(root, UpdateImg);
+worker = None
+if use_worker:
+    try: worker = marisco.RenderWorker(root, engine.render_uint8, ShowImg);
+    except ImportError: pass # no threading, calculate in the Tk main loop
 
 
 # variable Definition & Initialize
+hover = marisco.RenderScheduler(root, ShowInfo, delay_ms=hover_ms); # only the latest mouse position
 W = W_def; L=L_def; # defaults for intercative W/L adjust
-last_slice = -1;
 SL_tkVar = tk.IntVar(); SL_tkVar.set(Slice_def);
 TE_tkVar = tk.IntVar(); TE_tkVar.set(TE_def);
 TR_tkVar = tk.IntVar(); TR_tkVar.set(TR_def);
 TI_tkVar = tk.IntVar(); TI_tkVar.set(TI_def);
 ReImg_tkVar = tk.IntVar(); ReImg_tkVar.set(0);
 RecalcNoise = True # RecalcNoiseulated image, if not only W/L update
-# pregenerated list of random numbers
-# normal distribution, floats between 0.0 and 1.0
-Noise_Ref = [random.gauss(0, 1) for f in range (0,IMAGEWIDTH*IMAGELENGTH)];
-NoiseData = [0 for f in range (0,IMAGEWIDTH*IMAGELENGTH)];
 # Image placeholder
 IMG_tkLabel=tk.Label(text='Image initialisation failed\n\ninstall PIL\n&\npython-imaging-tk', bd=0, cursor='crosshair');
+try: display = marisco.ImageDisplay(IMG_tkLabel, IMAGEWIDTH, IMAGELENGTH, (zoom_X,zoom_Y), 'RGB');
+except: display = None; # may happen when missing python-imaging-tk
 # Image info text
 INF_tkVar = tk.StringVar(); INF_tkVar.set('');
 INF_tkLabel=tk.Label(textvariable=INF_tkVar, bd=0, font=('Courier', 8), width=0);
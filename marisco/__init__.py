@@ -0,0 +1,22 @@
+#
+# MaRISCo - Magnetic Resonance Image Simulation Calculator
+#
+# the simulation engine behind the MaRISCo GUIs, usable without Tk
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+from .physics import ATT, ATT_array, constrain
+from .sequences import SEQUENCES, Sequence
+from .tissues import TissueTable, BRAIN_TISSUES, EXTENDED_TISSUES
+from .sources import NiftiSource, TiffSource, PilSource
+from .tiffstore import TiffStore
+from .cache import CachedSource
+from .pyramid import PyramidSource, block_mean, preview_factor
+from .engine import SimulationEngine
+from .noise import NoiseBank
+from .volume import simulate_volume
+from .optimizer import null_ti, null_tr, grid_search, optimize
+from .display import ImageDisplay, gray_image, nn_zoom, pgm
+from .overlay import colorize
+from .scheduler import RenderScheduler, RenderWorker
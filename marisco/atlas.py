@@ -0,0 +1,151 @@
+#
+# Attenuation atlas: lookup tables of the signal equations over the slider grid
+#
+# the sliders only take integer TE 0..250, TR 0..16000 and TI 0..3000, the
+# attenuation factorizes into 1D tables per tissue
+#
+#   ATT = PD*exp(-TE/T2) * (1 - 2*exp(-TI/T1) + sign(TI)*exp(-(TR-TE)/T1))
+#
+# with exp(-TI/T1) stored as 0 and sign -1 for TI=0 (spin echo), instead of one
+# TE x TR x TI table (~1.2e9 values per tissue) that is 19.5e3 float32 values
+# per tissue, exact to float32, written once to the user cache directory
+# (atlas_file, named by the tissue parameters) or by python -m marisco.atlas,
+# and memory-mapped, every protocol of the grid is three lookups per tissue
+# contrast_map evaluates whole TE x TR planes of a tissue pair the same way,
+# for the contrast heat map of the GUI (see heatmap.py)
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+import sys
+import hashlib
+
+try: import numpy as np
+except ImportError: np = None
+
+from .optimizer import objective, feasible
+from .cachedir import cache_dir
+
+TE_MAX = 250
+TR_MAX = 16000
+TI_MAX = 3000
+# columns of the tables: T1, T2, PD, then PD*exp(-TE/T2), exp(-(TR-TE)/T1) for
+# TR-TE from -TE_MAX and exp(-TI/T1)
+E2 = 3
+E1 = E2+TE_MAX+1
+EI = E1+TR_MAX+TE_MAX+1
+COLUMNS = EI+TI_MAX+1
+
+
+def build_tables(table):
+    # (n_tissues, COLUMNS) float32 lookup tables of a TissueTable
+    T1 = np.abs(np.asarray(table.T1, dtype=np.float64))[:,np.newaxis]
+    T2 = np.abs(np.asarray(table.T2, dtype=np.float64))[:,np.newaxis]
+    PD = np.abs(np.asarray(table.PD, dtype=np.float64))[:,np.newaxis]
+    T1 = np.where(T1 == 0, sys.float_info.min, T1) # avoid division by zero (as ATT)
+    T2 = np.where(T2 == 0, sys.float_info.min, T2)
+    tables = np.empty((len(table), COLUMNS), dtype=np.float32)
+    tables[:,0:3] = np.hstack([T1, T2, PD])
+    with np.errstate(over='ignore'):
+        tables[:,E2:E1] = PD*np.exp(-np.arange(0, TE_MAX+1)/T2)
+        tables[:,E1:EI] = np.exp(-np.arange(-TE_MAX, TR_MAX+1)/T1)
+        tables[:,EI:] = np.exp(-np.arange(0, TI_MAX+1)/T1)
+    tables[:,EI] = 0. # TI=0: spin echo
+    return tables
+
+
+def atlas_file(table):
+    # cache file of the atlas of a TissueTable, keyed on the tissue parameters and
+    # the grid, a changed table gets a file of its own
+    params = repr([r[:4] for r in table.rows]+[(TE_MAX, TR_MAX, TI_MAX)])
+    key = hashlib.sha1(params.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir(), '%s-%s.atlas.npy' % ('_'.join(table.names), key))
+
+
+class AttenuationAtlas(object):
+    # table     TissueTable, the tissues of the engine
+    # filename  .npy file of the tables, memory-mapped, (re)written if missing or
+    #           of other tissue parameters, None: built in memory
+
+    def __init__(self, table, filename=None):
+        if np is None: raise ImportError('NumPy library not found, see http://www.numpy.org')
+        self.table = table
+        self.filename = filename
+        self.tables = None
+        params = build_tables(table)[:,0:3] if filename else None
+        if filename and os.path.exists(filename):
+            try:
+                tables = np.load(filename, mmap_mode='r')
+                if tables.shape == (len(table), COLUMNS) and np.array_equal(tables[:,0:3], params): self.tables = tables
+            except (IOError, OSError, ValueError): pass
+        if self.tables is None:
+            self.tables = build_tables(table)
+            if filename:
+                try: self.write(filename)
+                except (IOError, OSError): pass # e.g. read only installation, keep the tables in memory
+        self.sign = np.ones(TI_MAX+1, dtype=np.float32)
+        self.sign[0] = -1. # spin echo: 1 - exp(-(TR-TE)/T1)
+
+    def write(self, filename):
+        tmp = filename+'.tmp.npy'
+        np.save(tmp, np.asarray(self.tables))
+        if os.path.exists(filename): os.remove(filename)
+        os.rename(tmp, filename)
+        self.tables = np.load(filename, mmap_mode='r')
+
+    def covers(self, te, tr, ti):
+        # protocol(s) on the grid: integer values within the slider ranges, TR >= TE
+        if np.ndim(te) == np.ndim(tr) == np.ndim(ti) == 0: # single protocol, no array overhead
+            return te == int(te) and tr == int(tr) and ti == int(ti) and \
+                   0 <= te <= TE_MAX and te <= tr <= TR_MAX and 0 <= ti <= TI_MAX
+        te, tr, ti = [np.asarray(p) for p in (te, tr, ti)]
+        for p, max_ in ((te, TE_MAX), (tr, TR_MAX), (ti, TI_MAX)):
+            if not (np.all(p == np.round(p)) and np.all(p >= 0) and np.all(p <= max_)): return False
+        return bool(np.all(tr >= te))
+
+    def attenuation(self, te, tr, ti):
+        # attenuation factors (n_tissues,)+broadcast shape of the protocols, three
+        # lookups per tissue and protocol (see covers for the valid range)
+        t = self.tables
+        if np.ndim(te) == np.ndim(tr) == np.ndim(ti) == 0: # single protocol: column views
+            te = int(te); tr = int(tr); ti = int(ti)
+            return t[:,E2+te]*(1.-2.*t[:,EI+ti]+self.sign[ti]*t[:,E1+TE_MAX+tr-te])
+        te, tr, ti = [np.asarray(p, dtype=np.intp) for p in (te, tr, ti)]
+        ndim = max(te.ndim, tr.ndim, ti.ndim) # same number of dimensions to broadcast the lookups
+        te, tr, ti = [p.reshape((1,)*(ndim-p.ndim)+p.shape) for p in (te, tr, ti)]
+        recovery = 1.-2.*t[:,EI+ti]+self.sign[ti]*t[:,E1+TE_MAX+tr-te]
+        return (t[:,E2+te]*recovery).astype(np.float32)
+
+    def contrast_map(self, a, b, ti, te, tr, kind='contrast', mode='magnitude'):
+        # objective (see optimizer.py) of the tissues a, b (names) for the TE x TR
+        # plane te, tr (1D integer arrays) at the inversion time ti, NaN where the
+        # protocol is not feasible (TR < 2*TE+8 or TR < TI+TE)
+        ia = self.table.index(a); ib = self.table.index(b)
+        te = np.asarray(te, dtype=np.intp)[:,np.newaxis]; tr = np.asarray(tr, dtype=np.intp)[np.newaxis,:]
+        ok = feasible(te, tr, ti)
+        trs = np.where(ok, tr, te) # valid table index everywhere
+        att = self.attenuation(te, trs, ti)
+        with np.errstate(divide='ignore', invalid='ignore'): # TR=0, not feasible
+            value = objective(att[ia], att[ib], trs, kind, mode)
+        value[~ok] = np.nan
+        return value
+
+
+def main(argv=None):
+    import argparse
+    from .tissues import TissueTable, BRAIN_TISSUES, EXTENDED_TISSUES
+    parser = argparse.ArgumentParser(prog='python -m marisco.atlas', description='write the attenuation atlas of a tissue table')
+    parser.add_argument('filename', nargs='?', help='atlas file (.npy), default: in the user cache directory (see atlas_file)')
+    parser.add_argument('-t', '--tissues', default='brain', help="'brain', 'extended' or a tissue table file")
+    args = parser.parse_args(argv)
+    if args.tissues == 'brain': table = BRAIN_TISSUES
+    elif args.tissues == 'extended': table = EXTENDED_TISSUES
+    else: table = TissueTable.load(args.tissues)
+    filename = args.filename or atlas_file(table)
+    atlas = AttenuationAtlas(table)
+    atlas.write(filename)
+    print('%s: %d tissues x %d values (%.0f kB)' % (filename, len(table), COLUMNS, atlas.tables.nbytes/1024.))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#
+# Headless batch rendering of protocol sets for many subjects, e.g.
+#
+#   python -m marisco.batch -p protocols.txt -f png,nii -o out subject1 subject2 ...
+#
+# a subject is a directory with the GM/WM/CSF NIFTI files (GM.nii.gz, ...),
+# an RGBA.tif (extended tissues, or tissues.txt if present) or an RGB.tif
+# the protocol file has one protocol per line, name TE TR TI (ms), # comments,
+# without it the protocols of the README are rendered (T1w, T2w, FLAIR, T1-FLAIR)
+#
+# the slices are split into tasks for a process pool (one worker per core), the
+# workers open the subjects themselves and write every image as soon as it is
+# done: PNG files (8 bit, after W/L) and/or one float32 NIFTI volume per subject
+# and protocol (preallocated by the parent and written through a memory map),
+# only counts, times and value ranges go back to the parent
+# the volumes are scaled as a whole as by simulate_volume (volume.py): the noise
+# levels refer to the largest signal of the rendered slices (a noiseless pass in
+# the parent), the workers write the unscaled slices and the parent stores the
+# scaling to 0..1 once as scl_slope/scl_inter, the PNG images are normalized per slice
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+import sys
+import time
+import argparse
+
+try: import multiprocessing
+except ImportError: multiprocessing = None
+try: import numpy as np
+except ImportError: np = None
+try: import nibabel as nib
+except ImportError: nib = None
+try: from PIL import Image
+except ImportError: Image = None
+
+from .physics import constrain
+from .tissues import TissueTable, BRAIN_TISSUES, EXTENDED_TISSUES
+from .sources import NiftiSource, PilSource
+from .engine import SimulationEngine
+from .volume import create_volume, volume_map, volume_index, signal_max, simulate_slice, scaling, set_scaling
+
+# name, TE, TR, TI (ms), see README
+PROTOCOLS = [('T1w', 10, 200, 0), ('T2w', 120, 3000, 0),
+             ('FLAIR', 150, 1200, 2500), ('T1-FLAIR', 20, 2000, 800)]
+
+
+def load_protocols(filename):
+    # [(name, TE, TR, TI)], TI may be omitted (spin echo)
+    protocols = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line: continue
+            fields = line.replace(',', ' ').split()
+            if len(fields) == 3: fields.append('0')
+            protocols.append((fields[0], float(fields[1]), float(fields[2]), float(fields[3])))
+    return protocols
+
+def parse_slices(text, total_slices):
+    # '67', '60-80', '1,5,60-80' or 'all' to a list of 1 based slice numbers
+    if text in (None, 'all'): return list(range(1, total_slices+1))
+    slices = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            slices += list(range(int(first), int(last)+1))
+        else: slices.append(int(part))
+    for n in slices:
+        if not 1 <= n <= total_slices: raise ValueError('slice %d not in 1..%d' % (n, total_slices))
+    return slices
+
+def open_subject(path, prepare=False):
+    # tissue source of a subject directory
+    # prepare  (parent) write the uncompressed caches once, which the workers then map
+    if os.path.exists(os.path.join(path, BRAIN_TISSUES.names[0]+'.nii.gz')):
+        source = NiftiSource(path, cache=False)
+        if source.basis is None:
+            if prepare: source.write_cache()
+            else: source = NiftiSource(path, lazy=False) # no cache (e.g. read only), all in memory
+        return source
+    if os.path.exists(os.path.join(path, 'RGBA.tif')):
+        tissues = EXTENDED_TISSUES
+        if os.path.exists(os.path.join(path, 'tissues.txt')): tissues = TissueTable.load(os.path.join(path, 'tissues.txt'))
+        return PilSource(os.path.join(path, 'RGBA.tif'), tissues, scale=1/254., backend='numpy')
+    if os.path.exists(os.path.join(path, 'RGB.tif')):
+        return PilSource(os.path.join(path, 'RGB.tif'), backend='numpy')
+    raise IOError('no tissue images (GM.nii.gz, RGBA.tif or RGB.tif) in %s' % path)
+
+
+_subjects = {} # open sources of a worker process
+
+def render_task(task):
+    # renders the slices of one subject and protocol, writes every image when done
+    # max_  largest signal of the NIFTI volume (see signal_max), None without NIFTI output
+    # returns slices, seconds, NIFTI file and the value range of its slices
+    path, outdir, index, protocol, slices, max_, options = task
+    start = time.time()
+    source = _subjects.get(path)
+    if source is None: source = _subjects[path] = open_subject(path)
+    name, te, tr, ti = protocol
+    seed = options['seed']
+    engine = SimulationEngine(source, 'numpy', noise_model=options['noise'], seed=None if seed is None else [seed, index])
+    volume = None; filename = None; lo = np.inf; hi = -np.inf
+    if 'nii' in options['formats']:
+        filename = os.path.join(outdir, name+'.nii')
+        volume = volume_map(filename, source)
+        att = engine.attenuation(te, tr, ti)
+        unscaled = engine.buffer('volume', (source.height, source.width))
+    for slice in slices:
+        # the same noise whatever worker and task renders the slice
+        if seed is not None: engine.noise_bank.reseed([seed, index, slice])
+        if 'png' in options['formats']:
+            data = engine.render_uint8(slice, te, tr, ti, options['mode'], options['window'], options['level'])
+            Image.fromarray(data).save(os.path.join(outdir, '%s_%03d.png' % (name, slice)))
+        if volume is not None:
+            # the noise draws of the PNG image (seeded), at the level of the whole volume
+            if seed is not None: engine.noise_bank.reseed([seed, index, slice])
+            simulate_slice(engine, att, slice, max_, options['mode'], engine.noise_bank, unscaled)
+            lo = min(lo, float(np.amin(unscaled))); hi = max(hi, float(np.amax(unscaled)))
+            volume[volume_index(source, slice)] = unscaled[::-1] # rows bottom up
+    if volume is not None:
+        volume.flush()
+        del volume
+    return len(slices), time.time()-start, filename, lo, hi
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m marisco.batch', description='render MR protocols for segmented subjects')
+    parser.add_argument('subjects', nargs='+', help='subject directories')
+    parser.add_argument('-p', '--protocols', help='protocol file (name TE TR TI per line), default: the README protocols')
+    parser.add_argument('-s', '--slices', default='all', help="e.g. '67', '60-80', '1,5,60-80', default: all")
+    parser.add_argument('-f', '--format', default='png', help="'png', 'nii' or 'png,nii'")
+    parser.add_argument('-o', '--output', default='.', help='output directory, one subdirectory per subject')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='worker processes, default: one per core')
+    parser.add_argument('--mode', default='magnitude', choices=['magnitude', 'real'])
+    parser.add_argument('--window', type=float, default=1.0)
+    parser.add_argument('--level', type=float, default=0.5)
+    parser.add_argument('--noise', default='rician', choices=['rician', 'separate', 'coherent'])
+    parser.add_argument('--seed', type=int, default=0, help='noise seed, -1 for random noise')
+    args = parser.parse_args(argv)
+    formats = args.format.split(',')
+    if np is None: parser.error('NumPy library not found, see http://www.numpy.org')
+    if 'png' in formats and Image is None: parser.error('PNG output requires PIL (or pillow)')
+    if 'nii' in formats and nib is None: parser.error('NIFTI output requires NiBabel')
+    protocols = PROTOCOLS if args.protocols is None else load_protocols(args.protocols)
+    checked = []
+    for name, te, tr, ti in protocols:
+        limits = constrain(te, tr, ti)
+        if limits != (te, tr, ti): sys.stderr.write('%s: TE/TR/TI %g/%g/%g adjusted to %g/%g/%g\n' % ((name, te, tr, ti)+limits))
+        checked.append((name,)+limits)
+    options = {'formats': formats, 'mode': args.mode, 'window': args.window, 'level': args.level,
+               'noise': args.noise, 'seed': None if args.seed < 0 else args.seed}
+    jobs = args.jobs or (multiprocessing.cpu_count() if multiprocessing is not None else 1)
+    # tasks of a few slices each, caches and NIFTI files prepared here
+    tasks = []
+    for path in args.subjects:
+        source = open_subject(path, prepare=True)
+        slices = parse_slices(args.slices, source.total_slices)
+        outdir = os.path.join(args.output, os.path.basename(os.path.normpath(path)))
+        if not os.path.isdir(outdir): os.makedirs(outdir)
+        chunk = max(1, len(slices)//(4*jobs))
+        engine = SimulationEngine(source, 'numpy', noise_model=args.noise)
+        for index, protocol in enumerate(checked):
+            max_ = None
+            if 'nii' in formats:
+                create_volume(os.path.join(outdir, protocol[0]+'.nii'), source)
+                max_ = signal_max(engine, engine.attenuation(*protocol[1:]), slices)
+            for i in range(0, len(slices), chunk):
+                tasks.append((path, outdir, index, protocol, slices[i:i+chunk], max_, options))
+    total = sum([len(task[4]) for task in tasks])
+    # render, progress on stderr
+    start = time.time(); done = 0
+    ranges = {} # NIFTI file: value range of the slices written so far
+    if jobs > 1 and multiprocessing is not None:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(render_task, tasks)
+    else: pool = None; results = map(render_task, tasks)
+    for count, seconds, filename, lo, hi in results:
+        done += count
+        if filename is not None:
+            lo0, hi0 = ranges.get(filename, (np.inf, -np.inf))
+            ranges[filename] = (min(lo0, lo), max(hi0, hi))
+        elapsed = time.time()-start
+        sys.stderr.write('\r%d/%d slices  %.1f slices/s ' % (done, total, done/max(elapsed, 1e-9)))
+        sys.stderr.flush()
+    if pool is not None:
+        pool.close(); pool.join()
+    for filename, (lo, hi) in ranges.items(): set_scaling(filename, *scaling(lo, hi, args.mode))
+    elapsed = time.time()-start
+    sys.stderr.write('\n')
+    print('%d slices (%d subjects, %d protocols) in %.2f s: %.1f slices/s with %d worker(s)' %
+          (total, len(args.subjects), len(checked), elapsed, total/max(elapsed, 1e-9), jobs))
+
+if __name__ == '__main__':
+    main()
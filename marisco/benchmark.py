@@ -0,0 +1,170 @@
+#
+# Timing of the simulation steps, e.g.
+#
+#   python -m marisco.benchmark [RGB.tif] [slice]
+#
+# prints the time per frame in ms for the available backends and noise models,
+# next to the per-frame path they replace (baseline: shuffle of a pregenerated
+# list in MaRISCo_Lite/-X, two np.random.normal draws in MaRISCo.pyw), and for
+# the display fallback without PIL
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+import sys
+import random
+import timeit
+from operator import add, mul
+
+try: import numpy as np
+except ImportError: np = None
+
+from .sources import PilSource
+from .engine import SimulationEngine
+from . import kernels
+from .display import nn_zoom, pgm
+
+
+def per_frame(function, number=20):
+    # average time of one call in ms
+    function() # warm up (caches, first allocations)
+    return timeit.timeit(function, number=number)/number*1e3
+
+def old_noise(data, noise_ref, hw_noise=0.1):
+    # the noise of the calcImg formerly in MaRISCo_Lite/-X, for comparison
+    min_= min (data); max_= max (data)
+    n_level1 = max ([abs(max_), abs(min_)])
+    n_level1 += hw_noise
+    n_level1 *= 0.01
+    n_level2 = 0.01
+    random.shuffle(noise_ref)
+    return list(map(mul, [n_level1+n_level2*abs(f) for f in data], noise_ref))
+
+def old_calc_img(fractions, att, noise_ref, W=1.0, L=0.5):
+    # the list/map frame of the calcImg formerly in MaRISCo_Lite/-X (magnitude), for comparison
+    data_CSF_raw, data_GM_raw, data_WM_raw = fractions[:3]
+    CSF_att, GM_att, WM_att = att[:3]
+    data_CSF = [f * CSF_att for f in data_CSF_raw]
+    data_GM  = [f * GM_att for f in data_GM_raw]
+    data_WM  = [f * WM_att for f in data_WM_raw]
+    data = list(map(add, map(add, data_CSF, data_GM), data_WM))
+    data = list(map(add, data, old_noise(data, noise_ref)))
+    data = [abs(f) for f in data]
+    normalization=max(data)
+    if normalization == 0: normalization=sys.float_info.min
+    data = [((f/normalization-L)/W+0.5)*220. for f in data]
+    data = [0 if f<0 else f for f in data]
+    return [220. if f>220. else f for f in data]
+
+def old_noise_numpy(data):
+    # the noise of the Update formerly in MaRISCo.pyw, for comparison
+    max_ = np.amax(np.absolute(data)) + 0.1
+    noise = np.random.normal(loc=0., scale=0.01*max_, size=data.shape).astype(np.float32)
+    noise += np.random.normal(loc=0., scale=0.01, size=data.shape)*data.astype(np.float32)
+    return noise
+
+def old_update(fractions, att, W=1.0, L=0.5):
+    # the frame of the Update formerly in MaRISCo.pyw (magnitude, before display), for comparison
+    data = fractions[0]*att[0]
+    for f, a in zip(fractions[1:], att[1:]): data += f*a
+    data += old_noise_numpy(data)
+    data = np.absolute(data)
+    max_=np.amax(data)
+    if max_>0: data /= max_
+    data = (data-L)/W+0.5
+    mask0 = data>0.0; data *= mask0
+    mask1 = data<=1.0
+    mask1a = data>1.0
+    data = data*mask1 + mask1a.astype(int)
+    data *= 220.
+    return data
+
+def bench_noise(filename, slice):
+    # full frame (simulation, noise, W/L) and noise only, per noise model, and
+    # of the baselines (the rician frame is meant to fit their per-frame budget)
+    results = []
+    backends = ['numpy', 'python'] if np is not None else ['python']
+    for backend in backends:
+        source = PilSource(filename, backend=backend)
+        for model in ['coherent', 'separate', 'rician']:
+            if backend == 'python' and model == 'separate': continue
+            engine = SimulationEngine(source, backend, noise_model=model, seed=0)
+            frame = per_frame(lambda: engine.render_slice(slice, 100, 3000, 0))
+            signal = engine.signal.reshape(source.height, source.width) if backend == 'numpy' else engine.signal
+            if backend == 'numpy':
+                noise = per_frame(lambda: kernels.noise_numpy(signal, engine.hw_noise, model, engine.noise_bank))
+            else:
+                noise = per_frame(lambda: kernels.noise_python(signal, engine.hw_noise, engine.noise_bank, model))
+            results.append(('noise', backend, model, frame, noise))
+        # the baseline on the rendered slice of the last model
+        att = [a*source.scale for a in engine.attenuation(100, 3000, 0)]
+        fractions = source.slice(slice)
+        if backend == 'numpy':
+            fractions = np.asarray(fractions, dtype=np.float32)
+            signal = np.asarray(engine.signal.reshape(source.height, source.width))
+            frame = per_frame(lambda: old_update(fractions, att))
+            noise = per_frame(lambda: old_noise_numpy(signal))
+            results.append(('noise', backend, 'baseline (np.random.normal)', frame, noise))
+        else:
+            noise_ref = [random.gauss(0, 1) for f in range(0, source.width*source.height)]
+            signal = list(engine.signal)
+            frame = per_frame(lambda: old_calc_img(fractions, att, noise_ref))
+            noise = per_frame(lambda: old_noise(signal, noise_ref))
+            results.append(('noise', backend, 'baseline (shuffle, list/map)', frame, noise))
+    return results
+
+def old_NN_zoom(inp, x, y):
+    # the loop version formerly in MaRISCo.pyw, for comparison
+    scale_x = x/float(inp.shape[0]); scale_y = y/float(inp.shape[1]);
+    tmp = np.zeros([x,inp.shape[1]], dtype=type(inp[0,0]));
+    for i in range (0,x): tmp[i,:]=inp[int(i/scale_x),:];
+    out = np.zeros([x,y], dtype=type(inp[0,0]));
+    for j in range (0,y): out[:,j]=tmp[:,int(j/scale_y)];
+    return out
+
+def old_make_img(data):
+    # the string version formerly in MaRISCo.pyw, for comparison
+    x=data.shape[0]
+    y=data.shape[1]
+    min_=np.amin(data); data -= min_ # shift to min = 0
+    max_=np.amax(data);
+    if max_>0: data /= max_; # normalize to 1
+    data *= 191
+    data_int = data.astype(np.int32).swapaxes(0, 1).flatten()
+    data_str = "".join([chr(item) for item in data_int])
+    header_str = "P5 "+str(x)+" "+str(y)+" 255 "
+    return header_str+data_str
+
+def bench_fallback(filename, slice, zoom_target=2.5):
+    # zoom and PGM encoding of the display fallback without PIL (NumPy only)
+    source = PilSource(filename, backend='numpy')
+    engine = SimulationEngine(source, seed=0)
+    data = engine.render_uint8(slice, 100, 3000, 0)
+    zoom_X = int(source.width*source.pixdim[0]*zoom_target)
+    zoom_Y = int(source.height*source.pixdim[1]*zoom_target)
+    results = []
+    for name, width, height in [('zoom', zoom_X, zoom_Y), ('zoom x3', 3*source.width, 3*source.height)]:
+        old = per_frame(lambda: old_make_img(old_NN_zoom(data.swapaxes(0, 1).astype(np.float32), width, height)), 5)
+        new = per_frame(lambda: pgm(nn_zoom(data, width, height)))
+        results.append(('pgm', name, 'loops, str join', None, old))
+        results.append(('pgm', name, 'index arrays, bytes', None, new))
+    # index arrays versus the loops for the zoom alone
+    # (the old NN_zoom comment claimed indexing to be ~50% slower)
+    inp = data.swapaxes(0, 1).astype(np.float32)
+    results.append(('zoom', 'numpy', 'NN_zoom loops', None, per_frame(lambda: old_NN_zoom(inp, zoom_X, zoom_Y))))
+    results.append(('zoom', 'numpy', 'nn_zoom index arrays', None, per_frame(lambda: nn_zoom(data, zoom_X, zoom_Y))))
+    return results
+
+def main(argv):
+    filename = argv[1] if len(argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'RGB.tif')
+    slice = int(argv[2]) if len(argv) > 2 else 1
+    print('%-6s %-8s %-28s %10s %10s' % ('', 'backend', 'model', 'frame ms', 'step ms'))
+    results = bench_noise(filename, slice)
+    if np is not None: results += bench_fallback(filename, slice)
+    for name, backend, model, frame, step in results:
+        frame = '-' if frame is None else '%.3f' % frame
+        print('%-6s %-8s %-28s %10s %10.3f' % (name, backend, model, frame, step))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,125 @@
+#
+# Multi-slice cache for the tissue fraction sources
+#
+# CachedSource wraps any source (see sources.py) and keeps the decoded per
+# slice fractions in a bounded LRU cache (memory cap in bytes), a background
+# thread prefetches the next slices in the direction of motion
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+from collections import OrderedDict
+
+try: import threading
+except ImportError: threading = None # excluded from the MacOS standalone builds
+
+
+class _NoLock(object):
+    # stands in for threading.Lock without threading
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+
+
+def nbytes(fractions):
+    # memory of the fractions of one slice, (n_tissues,Y,X) array or list of array('f')
+    if hasattr(fractions, 'nbytes'): return fractions.nbytes
+    return sum([len(f)*f.itemsize for f in fractions])
+
+
+class CachedSource(object):
+    # source     the wrapped source, all other attributes are passed through
+    # max_bytes  memory cap of the cache
+    # prefetch   number of slices to prefetch ahead in the direction of motion
+    #            (and one behind), 0 or no threading: no prefetch
+
+    def __init__(self, source, max_bytes=256*2**20, prefetch=4):
+        self.source = source
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch if threading is not None else 0
+        self._cache = OrderedDict() # slice -> fractions, least recently used first
+        self._bytes = 0
+        self._last = None
+        self._direction = 1
+        # the wrapped source is not thread safe (PIL image, file handles)
+        self._source_lock = threading.RLock() if threading is not None else _NoLock()
+        self._cache_lock = threading.Lock() if threading is not None else _NoLock()
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evicted = 0
+        if self.prefetch > 0:
+            self._todo = []
+            self._cond = threading.Condition()
+            thread = threading.Thread(target=self._prefetch_loop, name='CachedSource')
+            thread.daemon = True
+            thread.start()
+
+    def __getattr__(self, name):
+        # tissues, width, height, total_slices, pixdim, scale, ... of the source
+        return getattr(self.source, name)
+
+    def _read(self, slice):
+        with self._source_lock: return self.source.slice(slice)
+
+    def _store(self, slice, fractions):
+        # with _cache_lock held
+        if slice in self._cache: return False
+        size = nbytes(fractions)
+        if size > self.max_bytes: return False # never fits, keep what is cached
+        while self._cache and self._bytes+size > self.max_bytes:
+            old, data = self._cache.popitem(last=False)
+            self._bytes -= nbytes(data)
+            self.evicted += 1
+        self._cache[slice] = fractions
+        self._bytes += size
+        return True
+
+    def slice(self, slice):
+        with self._cache_lock:
+            fractions = self._cache.pop(slice, None)
+            if fractions is not None:
+                self.hits += 1
+                self._cache[slice] = fractions # most recently used
+        if fractions is None:
+            fractions = self._read(slice)
+            with self._cache_lock:
+                self.misses += 1
+                self._store(slice, fractions)
+        if self._last is not None and slice != self._last: self._direction = 1 if slice > self._last else -1
+        self._last = slice
+        if self.prefetch > 0: self._schedule(slice)
+        return fractions
+
+    def page(self, slice):
+        # the (colour) TIF page of the slice (PilSource)
+        with self._source_lock: return self.source.page(slice)
+
+    def _schedule(self, slice):
+        # next slices in the direction of motion, then one behind
+        d = self._direction
+        todo = [slice+d*i for i in range(1, self.prefetch+1)]+[slice-d]
+        todo = [s for s in todo if 1 <= s <= self.source.total_slices]
+        with self._cond:
+            self._todo = todo # replaces what was not prefetched yet
+            self._cond.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._todo: self._cond.wait()
+                slice = self._todo.pop(0)
+            with self._cache_lock: cached = slice in self._cache
+            if cached: continue
+            fractions = self._read(slice)
+            with self._cache_lock:
+                if self._store(slice, fractions): self.prefetched += 1
+
+    def clear(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'prefetched': self.prefetched,
+                'evicted': self.evicted, 'slices': len(self._cache), 'bytes': self._bytes}
@@ -0,0 +1,39 @@
+#
+# Location of the derived cache files (uncompressed TIF pages, NIFTI basis,
+# attenuation atlas), kept out of the resource directories
+#
+#   $MARISCO_CACHE if set, otherwise the user cache directory
+#   (%LOCALAPPDATA%\marisco on Windows, $XDG_CACHE_HOME/marisco or
+#   ~/.cache/marisco elsewhere), the temp directory if that can't be created
+# file names carry a hash of the absolute source path, so sources of the same
+# name in different directories don't share a cache file
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+import sys
+import hashlib
+import tempfile
+
+
+def cache_dir():
+    # the cache directory, created if missing
+    base = os.environ.get('MARISCO_CACHE')
+    if not base:
+        if sys.platform == 'win32': root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        else: root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(root, 'marisco')
+    for path in (base, os.path.join(tempfile.gettempdir(), 'marisco')):
+        try:
+            if not os.path.isdir(path): os.makedirs(path)
+            return path
+        except (IOError, OSError): pass
+    return tempfile.gettempdir()
+
+def cache_file(path, suffix):
+    # cache file of a source file (or directory) path, e.g. cache_file('RGB.tif', '.raw')
+    path = os.path.abspath(path)
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir(), '%s-%s%s' % (name, key, suffix))
@@ -0,0 +1,78 @@
+#
+# Display stage of the GUIs
+#
+# ImageDisplay (requires PIL with ImageTk)
+#   the engine result is converted to an 8 bit image before resampling
+#   (resize in mode 'L'), and shown through one long-lived PhotoImage that is
+#   updated in place with paste(), no Tk image is allocated per frame
+#
+# nn_zoom, pgm (requires NumPy)
+#   fallback without PIL, nearest neighbour zoom by index arrays and a binary
+#   PGM (P5) image for the plain tk.PhotoImage
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: from PIL import Image
+except ImportError: Image = None
+
+try: import numpy as np
+except ImportError: np = None
+
+
+def gray_image(data, width, height):
+    # uint8 engine result (NumPy array or bytearray) to a PIL 'L' image
+    # (Y,X) arrays keep their own size (e.g. coarse previews)
+    if np is not None and isinstance(data, np.ndarray):
+        return Image.fromarray(data if data.ndim == 2 else data.reshape(height, width))
+    return Image.frombytes('L', (width, height), bytes(data))
+
+
+class ImageDisplay(object):
+    # label   Tk label showing the image
+    # width   size of the engine images
+    # height
+    # size    displayed size (zoom_X, zoom_Y)
+    # mode    'L' for grayscale only, 'RGB' to also show colored images
+
+    def __init__(self, label, width, height, size, mode='L', resample=None):
+        from PIL import ImageTk # imports Tk, only needed here
+        self.label = label
+        self.width = width
+        self.height = height
+        self.size = tuple(size)
+        self.resample = Image.BICUBIC if resample is None else resample
+        self.photo = ImageTk.PhotoImage(mode, self.size)
+        label.configure(image=self.photo)
+        label.image = self.photo # keep a reference!
+
+    def image(self, data):
+        # uint8 engine result to a PIL image of the displayed size
+        return gray_image(data, self.width, self.height).resize(self.size, resample=self.resample)
+
+    def show(self, im):
+        # PIL image (any mode) of the displayed size, pasted into the PhotoImage
+        if im.size != self.size: im = im.resize(self.size, resample=self.resample)
+        self.photo.paste(im)
+
+    def show_data(self, data):
+        self.show(self.image(data))
+
+
+# ============================= fallback without PIL ===========================
+
+def nn_zoom(data, width, height):
+    # nearest neighbour zoom of a (Y,X) image to (height,width)
+    # np.repeat for integer factors, precomputed index arrays otherwise
+    y, x = data.shape
+    if width % x == 0 and height % y == 0:
+        return np.repeat(np.repeat(data, height//y, axis=0), width//x, axis=1)
+    iy = np.arange(height)*y//height
+    ix = np.arange(width)*x//width
+    return data.take(iy, axis=0).take(ix, axis=1)
+
+def pgm(data):
+    # (Y,X) uint8 image as binary PGM (P5) for tk.PhotoImage(data=...)
+    height, width = data.shape
+    header = ('P5 %d %d 255\n' % (width, height)).encode('ascii')
+    return header + np.ascontiguousarray(data, dtype=np.uint8).tobytes()
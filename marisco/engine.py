@@ -0,0 +1,243 @@
+#
+# Simulation engine, calculates the synthetic MR image for a slice
+# independent of any GUI (no Tk required)
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+
+try: import numpy as np
+except ImportError: np = None
+
+from .physics import ATT, ATT_array
+from .noise import NoiseBank
+from .sequences import SEQUENCES
+from . import kernels
+
+
+class SimulationEngine(object):
+    # source      tissue fraction source (see sources.py)
+    # backend     'numpy' or 'python', defaults to the backend of the source
+    # hw_noise    amount of minimum hardware noise
+    # noise_model 'rician' (default, independent sources, real and imaginary channel),
+    #             'separate' (independent sources, real only) or 'coherent' (single source)
+    #             the python backend implements 'rician' and 'coherent'
+    # seed        seed of the noise bank, for reproducible noise
+    # atlas       AttenuationAtlas of the source tissues (see atlas.py), lookups
+    #             instead of the signal equations for protocols on the slider grid
+    #             (NumPy backend, math.exp is faster than the lookups in python)
+
+    def __init__(self, source, backend=None, hw_noise=0.1, noise_model='rician', seed=None, atlas=None):
+        if backend is None: backend = getattr(source, 'backend', 'numpy')
+        if backend == 'numpy' and np is None:
+            raise ImportError('NumPy library not found, see http://www.numpy.org')
+        self.source = source
+        self.backend = backend
+        self.hw_noise = hw_noise
+        self.noise_model = noise_model
+        self.atlas = atlas
+        self.tissue_scale = {} # additional per tissue factors e.g. {'FAT': 0.5}
+        self.signal = None     # noiseless signal of the last rendered slice (flat, row major)
+        self.fractions = None  # tissue fractions of the last rendered slice (flat per tissue)
+        self.NoiseData = None
+        self._key = None       # state of the cached normalized image
+        self._bboxes = {}      # bounding box of the voxels with any tissue per slice
+        self.bbox_fraction = 0.75
+        self._normalized = None
+        self._buffers = {}     # preallocated work arrays of the NumPy backend, see buffer()
+        self._flip = 0         # alternates the two output buffers
+        self._frame = 0        # number of simulations, tells when the probe signal is stale
+        self._probe = None     # [slice, table, frame] of probe_table
+        self._published = None # (key, frame, signal) of the last render, replaced as a whole (see probe)
+        # pregenerated random numbers (normal distribution), see noise.py
+        self.noise_bank = NoiseBank(source.width*source.height, backend, seed)
+
+    @property
+    def tissues(self):
+        return self.source.tissues
+
+    def factors(self):
+        # per tissue factors converting stored values into fractions, times tissue_scale
+        scale = self.source.scale
+        return [scale*self.tissue_scale.get(name, 1.0) for name in self.source.tissues.names]
+
+    def attenuation(self, te, tr, ti, sequence=None, params=None):
+        # attenuation factors of all tissues for one protocol
+        # sequence  name of a sequence of the registry (see sequences.py) with its
+        #           params (dict, defaults for the missing), None: spin echo/inversion recovery
+        if sequence not in (None, 'SE'):
+            att = SEQUENCES[sequence].attenuation(self.source.tissues, te, tr, ti, params)*self.factors()
+            return att.astype(np.float32) if self.backend == 'numpy' else att.tolist()
+        if self.backend == 'numpy':
+            if self.atlas is not None and self.atlas.covers(te, tr, ti):
+                return self.atlas.attenuation(te, tr, ti)*np.array(self.factors(), dtype=np.float32)
+            return self.attenuation_array(te, tr, ti)[0]
+        table = self.source.tissues
+        return [ATT(T1, T2, PD, te, tr, ti)*f
+                for T1, T2, PD, f in zip(table.T1, table.T2, table.PD, self.factors())]
+
+    def attenuation_array(self, te, tr, ti):
+        # attenuation factors for many protocols at once, shape (n_protocols, n_tissues)
+        # one vectorized evaluation over the tissue table columns
+        te, tr, ti = [np.ravel(p) for p in np.broadcast_arrays(te, tr, ti)]
+        table = self.source.tissues
+        att = ATT_array(table.T1, table.T2, table.PD, te[:,np.newaxis], tr[:,np.newaxis], ti[:,np.newaxis])
+        return (att*self.factors()).astype(np.float32)
+
+    def basis(self, slice):
+        # tissue fractions of a slice stacked to shape (n_tissues, Y*X)
+        fractions = np.asarray(self.source.slice(slice), dtype=np.float32)
+        return fractions.reshape(fractions.shape[0], -1)
+
+    def bbox(self, slice, fractions=None):
+        # (y0, y1, x0, x1) of the voxels with any tissue, once per slice
+        # precomputed by the source if available (bboxes), otherwise from the fractions
+        # None if the box covers more than bbox_fraction of the image (cropping doesn't pay)
+        if slice not in self._bboxes:
+            bboxes = getattr(self.source, 'bboxes', None)
+            if bboxes is not None: box = tuple([int(b) for b in bboxes[slice-1]])
+            else:
+                if fractions is None: fractions = self.source.slice(slice)
+                if self.backend == 'numpy': box = kernels.bbox_numpy(fractions)
+                else: box = kernels.bbox_python(fractions, self.source.width)
+            y0, y1, x0, x1 = box
+            if (y1-y0)*(x1-x0) > self.bbox_fraction*self.source.width*self.source.height: box = None
+            self._bboxes[slice] = box
+        return self._bboxes[slice]
+
+    def buffer(self, name, shape, dtype=None):
+        # preallocated (float32) array reused by every frame, reallocated if the shape changes
+        dtype = np.dtype(np.float32 if dtype is None else dtype)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def output(self, dtype):
+        # two alternating result buffers: the last image stays valid while the next one
+        # is computed (e.g. displayed on the Tk thread while the render worker continues)
+        self._flip ^= 1
+        return self.buffer(('output', self._flip), (self.source.height, self.source.width), dtype)
+
+    def probe_table(self, slice):
+        # (Y,X) structured array of the slice, built once when the slice is probed first:
+        # the tissue fractions as uint8 (1/255 steps) by tissue name, and the noiseless
+        # 'signal' (float32) of the last rendered protocol (NaN if that was another slice)
+        if self._probe is None or self._probe[0] != slice:
+            names = self.source.tissues.names
+            fractions = np.asarray(self.source.slice(slice), dtype=np.float32)
+            table = np.empty(fractions.shape[1:], dtype=[(name, np.uint8) for name in names]+[('signal', np.float32)])
+            scale = np.float32(self.source.scale*255.)
+            for name, frac in zip(names, fractions): table[name] = np.clip(frac*scale+np.float32(0.5), 0., 255.)
+            self._probe = [slice, table, None]
+        table = self._probe[1]
+        published = self._published # read once, a RenderWorker may render meanwhile
+        frame = published[1] if published is not None else 0
+        if self._probe[2] != frame: # copied once per simulation, not per probe
+            if published is not None and published[0][0] == slice: table['signal'] = published[2].reshape(table.shape)
+            else: table['signal'] = np.nan
+            self._probe[2] = frame
+        return table
+
+    def probe(self, slice, x, y, te=None, tr=None, ti=None):
+        # tissue fractions (0..1, by name) and 'signal' at column x, row y of the slice
+        # signal of the protocol te, tr, ti if given, otherwise of the last rendered one
+        # (None if another slice was rendered last)
+        # safe on the GUI thread while a RenderWorker renders: the signal is read from
+        # the snapshot normalized publishes after each render, never from the work buffers
+        names = self.source.tissues.names
+        if self.backend == 'numpy':
+            row = self.probe_table(slice)[y, x]
+            result = dict([(name, int(row[name])/255.) for name in names])
+            signal = float(row['signal'])
+            result['signal'] = signal if signal == signal else None
+            if te is not None: values = np.asarray(self.source.slice(slice))[:,y,x]
+        else:
+            i = x+y*self.source.width
+            values = [f[i] for f in self.source.slice(slice)]
+            result = dict([(name, v*self.source.scale) for name, v in zip(names, values)])
+            published = self._published
+            rendered = published is not None and published[0][0] == slice
+            result['signal'] = published[2][i] if rendered else None
+        if te is not None: result['signal'] = float(sum([a*v for a, v in zip(self.attenuation(te, tr, ti), values)]))
+        return result
+
+    def sweep_chunks(self, te, tr, ti, slice=None, chunk_size=256):
+        # noiseless signal for arrays of TE/TR/TI (broadcast against each other)
+        # yields (first protocol, stack) with stacks of at most chunk_size protocols
+        # stack shape is (n, Y, X) for a single slice, (n, Z, Y, X) for slice=None (whole volume)
+        att = self.attenuation_array(te, tr, ti)
+        shape = (self.source.height, self.source.width)
+        if slice is not None: basis = self.basis(slice)
+        elif getattr(self.source, 'basis', None) is not None: basis = self.source.basis.reshape(len(self.tissues), -1)
+        else: basis = np.concatenate([self.basis(s) for s in range(1, self.source.total_slices+1)], axis=1)
+        if slice is None: shape = (self.source.total_slices,)+shape
+        for p0 in range(0, att.shape[0], chunk_size):
+            # one contraction over the tissues for all protocols of the chunk
+            stack = np.dot(att[p0:p0+chunk_size], basis).reshape((-1,)+shape)
+            yield p0, stack
+
+    def sweep(self, te, tr, ti, slice=None, chunk_size=256, out=None):
+        # as sweep_chunks, but returns the complete stack
+        # out may be a preallocated (e.g. numpy.memmap) array to keep big sweeps off memory
+        n = np.broadcast(te, tr, ti).size
+        shape = (self.source.height, self.source.width)
+        if slice is None: shape = (self.source.total_slices,)+shape
+        if out is None: out = np.empty((n,)+shape, dtype=np.float32)
+        for p0, stack in self.sweep_chunks(te, tr, ti, slice, chunk_size):
+            out[p0:p0+stack.shape[0]] = stack
+        return out
+
+    def normalized(self, slice, te, tr, ti, mode='magnitude', recalc_noise=True, sequence=None, params=None):
+        # noisy image normalized to 0..1, before W/L
+        # cached for the last (slice, TE, TR, TI, mode, tissue factors, sequence, noise) state
+        key = (slice, te, tr, ti, mode, tuple(self.factors()), sequence, tuple(sorted(params.items())) if params else None)
+        if not recalc_noise and key == self._key: return self._normalized
+        if recalc_noise: self.NoiseData = None
+        att = self.attenuation(te, tr, ti, sequence, params)
+        fractions = self.source.slice(slice)
+        bbox = self.bbox(slice, fractions)
+        if self.backend == 'numpy':
+            # all steps in place on preallocated buffers, nothing is allocated once warm
+            shape = (self.source.height, self.source.width)
+            scratch = self.buffer('scratch', shape)
+            signal = kernels.combine_numpy(att, fractions, bbox, self.buffer('signal', shape), scratch)
+            if self.NoiseData is None:
+                noise = self.buffer('noise', (2,)+shape if self.noise_model == 'rician' else shape)
+                self.NoiseData = kernels.noise_numpy(signal, self.hw_noise, self.noise_model, self.noise_bank, bbox, noise, scratch)
+            self._normalized = kernels.normalize_numpy(signal, self.NoiseData, mode, self.buffer('normalized', shape), scratch)
+            self.signal = signal.reshape(-1)
+            self.fractions = fractions.reshape(fractions.shape[0], -1)
+            # two alternating snapshot buffers (as output), the last one stays valid while the next render runs
+            published = self.buffer(('snapshot', self._frame & 1), shape)
+            np.copyto(published, signal)
+        else:
+            width = self.source.width
+            signal = kernels.combine_python(att, fractions, bbox, width)
+            if self.NoiseData is None:
+                self.NoiseData = kernels.noise_python(signal, self.hw_noise, self.noise_bank, self.noise_model, bbox, width)
+            self._normalized = kernels.normalize_python(signal, self.NoiseData, mode)
+            self.signal = signal
+            self.fractions = fractions
+            published = signal # a new list every render
+        self._key = key
+        self._frame += 1
+        self._published = (key, self._frame, published)
+        return self._normalized
+
+    def render_slice(self, slice, te, tr, ti, mode='magnitude', window=1.0, level=0.5, recalc_noise=True, sequence=None, params=None):
+        # returns the image (values 0..220) of shape (Y,X), as flat list for the python backend
+        # mode is 'magnitude' or 'real' (real part image: negative signals shifted to positive)
+        # with recalc_noise=False only changes of W/L skip the simulation (see normalized)
+        # the NumPy result is one of two reused buffers (see output), copy it to keep it
+        # sequence, params  see attenuation
+        data = self.normalized(slice, te, tr, ti, mode, recalc_noise, sequence, params)
+        if self.backend == 'numpy': return kernels.window_numpy(data, window, level, out=self.output(np.float32))
+        else: return kernels.window_python(data, window, level)
+
+    def render_uint8(self, slice, te, tr, ti, mode='magnitude', window=1.0, level=0.5, recalc_noise=True, sequence=None, params=None):
+        # as render_slice, but as uint8 image (bytearray for the python backend)
+        data = self.normalized(slice, te, tr, ti, mode, recalc_noise, sequence, params)
+        if self.backend == 'numpy':
+            return kernels.window_numpy(data, window, level, out=self.output(np.uint8), scratch=self.buffer('scratch', data.shape))
+        else: return kernels.window_python(data, window, level, uint8=True)
@@ -0,0 +1,101 @@
+#
+# Contrast heat map of a tissue pair over the TE x TR plane (requires PIL and Tk)
+#
+# HeatMapView is a separate window with the contrast (see atlas.contrast_map) of
+# the TE x TR plane at the current TI, TE upwards and TR to the right, protocols
+# outside the slider limits in gray, and a marker at the current protocol
+# the plane is only recomputed when TI, the mode or the TR range change (~1 ms),
+# TE/TR changes just move the marker on a copy of the cached image, so the view
+# follows the sliders while dragging
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: import numpy as np
+except ImportError: np = None
+try: from PIL import Image, ImageDraw
+except ImportError: Image = None
+
+from .atlas import TE_MAX
+
+BACKGROUND = 219 # gray of the protocols that are not feasible
+
+
+def hot_colors(values):
+    # (Y,X) values 0..1 (NaN: not feasible) to (Y,X,3) uint8, black-red-yellow-white
+    x = np.nan_to_num(values)*3.
+    rgb = np.clip(np.stack([x, x-1., x-2.], axis=-1), 0., 1.)
+    rgb = (rgb*255.+0.5).astype(np.uint8)
+    rgb[np.isnan(values)] = BACKGROUND
+    return rgb
+
+
+class HeatMapView(object):
+    # root    Tk root, the view is a Toplevel window, hidden until shown
+    # atlas   AttenuationAtlas of the engine tissues
+    # a, b    tissue pair (names)
+    # size    displayed size
+    # steps   TE x TR samples of the plane
+
+    def __init__(self, root, atlas, a='GM', b='WM', size=(251, 251), steps=(126, 251)):
+        try: import Tkinter as tk   # Python2
+        except ImportError: import tkinter as tk # Python3
+        from PIL import ImageTk # imports Tk, only needed here
+        self.atlas = atlas
+        self.a = a
+        self.b = b
+        self.size = tuple(size)
+        self.steps = steps
+        self.window = tk.Toplevel(root)
+        self.window.title('%s/%s contrast  (TE up, TR right)' % (a, b))
+        self.window.resizable(width=False, height=False)
+        self.window.protocol('WM_DELETE_WINDOW', self.hide)
+        self.photo = ImageTk.PhotoImage('RGB', self.size)
+        self.label = tk.Label(self.window, image=self.photo)
+        self.label.image = self.photo # keep a reference!
+        self.label.pack()
+        self.window.withdraw()
+        self.visible = False
+        self._key = None   # (TI, mode, TR range) of the cached plane
+        self._plane = None # PIL image of the plane, without marker
+        self._last = None  # last protocol, shown when the window opens
+
+    def toggle(self, event=None):
+        if self.visible: self.hide()
+        else: self.show()
+
+    def show(self):
+        self.window.deiconify()
+        self.visible = True
+        if self._last is not None: self.update(*self._last)
+
+    def hide(self):
+        self.window.withdraw()
+        self.visible = False
+
+    def plane(self, ti, mode, tr_max):
+        # the TE x TR plane at ti as PIL image of the displayed size
+        te = np.round(np.linspace(0, TE_MAX, self.steps[0]))
+        tr = np.round(np.linspace(0, tr_max, self.steps[1]))
+        value = self.atlas.contrast_map(self.a, self.b, ti, te, tr, 'contrast', mode)
+        max_ = np.nanmax(value) if np.any(value == value) else 0.
+        if max_ > 0: value /= max_
+        im = Image.fromarray(hot_colors(value[::-1]), 'RGB') # TE upwards
+        return im.resize(self.size, resample=Image.NEAREST)
+
+    def update(self, te, tr, ti, mode='magnitude', tr_max=4000):
+        # marker at te, tr on the plane of ti (recomputed if ti, mode or tr_max changed)
+        self._last = (te, tr, ti, mode, tr_max)
+        if not self.visible: return
+        key = (int(ti), mode, int(tr_max))
+        if key != self._key:
+            self._plane = self.plane(int(ti), mode, int(tr_max))
+            self._key = key
+        im = self._plane.copy()
+        w, h = self.size
+        x = int(round(float(tr)/tr_max*(w-1))); y = int(round((1.-float(te)/TE_MAX)*(h-1)))
+        draw = ImageDraw.Draw(im)
+        draw.line([(x, 0), (x, h-1)], fill=(0, 160, 255))
+        draw.line([(0, y), (w-1, y)], fill=(0, 160, 255))
+        draw.ellipse([x-3, y-3, x+3, y+3], outline=(0, 255, 255))
+        self.photo.paste(im)
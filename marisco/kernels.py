@@ -0,0 +1,262 @@
+#
+# Image kernels of the simulation engine
+#
+#   combine   tissue fractions times attenuation factors, summed up
+#   noise     noise to add to the combined signal
+#   normalize add noise, magnitude/real part, normalization to 0..1
+#   window    W/L, scaling to 220 and clamping
+#   bbox      bounding box of the voxels with any tissue, combine and the signal
+#             dependent noise levels are only computed inside, the background
+#             only gets the (constant) hardware noise
+#
+# there is a NumPy version of each, and a compact pure python fallback for
+# the standalone builds (array('f') buffers and fused single pass loops)
+# the NumPy kernels work in float32 and take preallocated out (and scratch)
+# buffers, all steps run in place (ufuncs with out=), with numexpr installed (and
+# more than one core) the multi-operand expressions are evaluated in one threaded pass
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import sys
+from math import sqrt
+from array import array
+
+try: import numpy as np
+except ImportError: np = None
+try: import numexpr as ne # optional, fused multi-operand expressions
+except ImportError: ne = None
+# single threaded numexpr is slower than the in-place ufuncs (~2x for the magnitude),
+# it only pays with its thread pool
+if ne is not None and ne.detect_number_of_cores() < 2: ne = None
+
+
+# ================================== NumPy ===================================
+
+def bbox_numpy(fractions):
+    # (y0, y1, x0, x1) of the voxels with any tissue, (0, 0, 0, 0) for an empty slice
+    tissue = np.any(fractions, axis=0)
+    rows = np.flatnonzero(tissue.any(axis=1))
+    if rows.size == 0: return (0, 0, 0, 0)
+    cols = np.flatnonzero(tissue.any(axis=0))
+    return (int(rows[0]), int(rows[-1])+1, int(cols[0]), int(cols[-1])+1)
+
+def _box(bbox):
+    # index of the bounding box in a (Y,X) image, the whole image for None
+    if bbox is None: return (slice(None), slice(None))
+    return (slice(bbox[0], bbox[1]), slice(bbox[2], bbox[3]))
+
+def _work(scratch, shape):
+    # float32 work array of shape, a view into the preallocated scratch buffer if given
+    if scratch is None: return np.empty(shape, dtype=np.float32)
+    size = 1
+    for n in shape: size *= n
+    return scratch.reshape(-1)[:size].reshape(shape)
+
+def combine_numpy(att, fractions, bbox=None, out=None, scratch=None):
+    # one contraction over the tissues, fractions of shape (n_tissues, Y, X)
+    # out      preallocated (Y,X) float32 result
+    # scratch  preallocated (Y,X) float32 work buffer
+    att = np.asarray(att, dtype=np.float32)
+    if out is None: out = np.empty(fractions.shape[1:], dtype=np.float32)
+    if bbox is None:
+        if fractions.dtype == np.float32: # matrix-vector product straight into out
+            np.dot(att, fractions.reshape(fractions.shape[0], -1), out=out.reshape(-1))
+        else: out[...] = np.tensordot(att, fractions, axes=1)
+        return out
+    box = _box(bbox)
+    y0, y1, x0, x1 = bbox
+    out[:y0] = 0.; out[y1:] = 0.; out[y0:y1,:x0] = 0.; out[y0:y1,x1:] = 0.
+    inside = out[box]
+    crop = fractions[(slice(None),)+box]
+    # one matrix-vector product over the box (the reshape copies the crop), into scratch
+    term = _work(scratch, (inside.size,))
+    np.dot(att, crop.reshape(crop.shape[0], -1).astype(np.float32, copy=False), out=term)
+    inside[...] = term.reshape(inside.shape)
+    return out
+
+def noise_numpy(signal, hw_noise, model, bank, bbox=None, out=None, scratch=None, max_=None):
+    # 'rician'    independent hardware and physiological sources, each with a real
+    #             and an imaginary channel, returned stacked as (2,)+signal.shape
+    #             (Rician magnitude, Gaussian real part image)
+    # 'separate'  independent sources for hardware and physiological noise (real only)
+    # 'coherent'  both levels referencing a single noise source
+    # bank        NoiseBank of standard normal samples (see noise.py)
+    # bbox        signal is zero outside, there only the hardware noise level is used
+    # out         preallocated float32 result, scratch a (Y,X) float32 work buffer
+    # max_        largest |signal| the noise levels refer to, default: of this signal
+    #             (e.g. of the whole volume, for the same noise level in every slice)
+    box = _box(bbox)
+    inside = signal[box]
+    if max_ is None: max_ = max(np.amax(inside), -np.amin(inside)) if inside.size else 0.
+    max_ += hw_noise # amount of minimum hardware noise
+    hw = np.float32(0.01*max_) # background level
+    if out is None: out = np.empty((2,)+signal.shape if model == 'rician' else signal.shape, dtype=np.float32)
+    level = _work(scratch, inside.shape)
+    if model == 'rician':
+        # the sum of the independent gaussian sources is gaussian with the summed
+        # variances, so one draw per channel is enough
+        if ne is not None:
+            ne.evaluate('sqrt(hw2+c*s*s)', local_dict={'hw2': hw*hw, 'c': np.float32(0.01**2), 's': inside}, out=level)
+        else:
+            np.square(inside, out=level)
+            level *= np.float32(0.01**2); level += hw*hw
+            np.sqrt(level, out=level)
+        for channel in out:
+            ref = bank.draw(signal.shape)
+            if bbox is not None: np.multiply(ref, hw, out=channel)
+            np.multiply(ref[box], level, out=channel[box])
+        return out
+    ref = bank.draw(signal.shape)
+    if model == 'coherent':
+        np.absolute(inside, out=level)
+        level *= np.float32(0.01); level += hw
+        if bbox is not None: np.multiply(ref, hw, out=out)
+        np.multiply(ref[box], level, out=out[box])
+        return out
+    np.multiply(ref, hw, out=out)
+    np.multiply(inside, np.float32(0.01), out=level)
+    level *= bank.draw(signal.shape)[box]
+    out[box] += level
+    return out
+
+def normalize_numpy(signal, noise, mode, out=None, scratch=None, normalize=True):
+    # noisy image normalized to 0..1 (before W/L)
+    # noise of shape (2,)+signal.shape holds a real and an imaginary channel
+    # out      preallocated float32 result, scratch a work buffer of the same shape
+    # normalize False: magnitude or real part only, not shifted or scaled (e.g. one
+    #          slice of a volume, which is scaled as a whole)
+    complex_ = noise.ndim > signal.ndim
+    real = noise[0] if complex_ else noise
+    data = np.empty(signal.shape, dtype=np.float32) if out is None else out
+    # Magnitude versus Real part Images (deal with negative values)
+    if mode == 'magnitude' and complex_:                 # Magnitude Image (Rician)
+        if ne is not None:
+            ne.evaluate('sqrt((s+re)*(s+re)+im*im)', local_dict={'s': signal, 're': real, 'im': noise[1]}, out=data)
+        else: # square, add and sqrt in place, ~4x faster than np.hypot
+            np.add(signal, real, out=data)
+            np.multiply(data, data, out=data)
+            imag = _work(scratch, signal.shape)
+            np.multiply(noise[1], noise[1], out=imag)
+            data += imag
+            np.sqrt(data, out=data)
+    else:
+        np.add(signal, real, out=data)
+        if mode == 'magnitude': np.absolute(data, out=data) # Magnitude Image
+        elif normalize: data -= np.amin(data)               # Re Image: shift to positive
+    if not normalize: return data
+    max_ = np.amax(data)
+    if max_ > 0: data /= max_
+    return data
+
+def window_numpy(data, W, L, dtype=None, out=None, scratch=None):
+    # W/L and scaling to 220 as one fused multiply-add and clip
+    # out      preallocated result (of the requested dtype), for integer types the
+    #          float32 values are computed in scratch and then cast into out
+    a = np.float32(220./W); b = np.float32((0.5-L/W)*220.)
+    if out is not None: dtype = out.dtype
+    direct = dtype is None or np.dtype(dtype) == np.float32
+    if direct and out is not None: values = out
+    elif direct or scratch is None: values = np.empty(data.shape, dtype=np.float32)
+    else: values = _work(scratch, data.shape)
+    if ne is not None: ne.evaluate('d*a+b', local_dict={'d': data, 'a': a, 'b': b}, out=values)
+    else:
+        np.multiply(data, a, out=values)
+        values += b
+    np.clip(values, 0., 220., out=values)
+    if direct: return values
+    if out is None: return values.astype(dtype)
+    np.copyto(out, values, casting='unsafe') # truncates as astype
+    return out
+
+
+# =============================== pure python ================================
+
+def _bytes(frac):
+    return frac.tobytes() if hasattr(frac, 'tobytes') else frac.tostring() # Python 2
+
+def bbox_python(fractions, width):
+    # as bbox_numpy for flat array('f') fractions, zero runs are found on the raw bytes
+    itemsize = fractions[0].itemsize; rowbytes = width*itemsize
+    height = len(fractions[0])//width
+    y0 = x0 = sys.maxsize; y1 = x1 = 0
+    for frac in fractions:
+        raw = _bytes(frac)
+        for y in range(0, height):
+            row = raw[y*rowbytes:(y+1)*rowbytes]
+            left = len(row)-len(row.lstrip(b'\0'))
+            if left == len(row): continue
+            right = len(row.rstrip(b'\0'))
+            y0 = min(y0, y); y1 = max(y1, y+1)
+            x0 = min(x0, left//itemsize); x1 = max(x1, (right+itemsize-1)//itemsize)
+    if y1 == 0: return (0, 0, 0, 0)
+    return (y0, y1, x0, x1)
+
+def _rows(bbox, width):
+    # flat (start, stop) of the bounding box rows
+    y0, y1, x0, x1 = bbox
+    return [(y*width+x0, y*width+x1) for y in range(y0, y1)]
+
+def combine_python(att, fractions, bbox=None, width=None):
+    if bbox is None:
+        data = [0.0]*len(fractions[0])
+        for frac, a in zip(fractions, att):
+            if a == 0: continue
+            data = [d+f*a for d, f in zip(data, frac)]
+        return data
+    # only inside the bounding box, rows cut out and put back by slicing
+    rows = _rows(bbox, width)
+    crop = [0.0]*sum([stop-start for start, stop in rows])
+    for frac, a in zip(fractions, att):
+        if a == 0: continue
+        inside = array('f')
+        for start, stop in rows: inside.extend(frac[start:stop])
+        crop = [d+f*a for d, f in zip(crop, inside)]
+    data = [0.0]*len(fractions[0]); i = 0
+    for start, stop in rows:
+        data[start:stop] = crop[i:i+stop-start]; i += stop-start
+    return data
+
+def noise_python(signal, hw_noise, bank, model='coherent', bbox=None, width=None):
+    # 'coherent'  sumation of the levels referencing to a single noise source, not
+    #             strictly correct, noise sources are addad coherently, results are
+    #             sligtly larger
+    # 'rician'    independent sources (the gaussian sum has the summed variances),
+    #             real and imaginary channel returned as a tuple
+    # bbox        signal is zero outside, there only the hardware noise level is used
+    n_level1 = max(abs(max(signal)), abs(min(signal)))
+    n_level1 += hw_noise # amount of minimum hardware noise
+    n_level1 *= 0.01     # amount of noise that scales linear with normalization (attenuator)
+    n_level2 = 0.01      # simple model for physiological noise
+    rows = [(0, len(signal))] if bbox is None else _rows(bbox, width)
+    level = [n_level1]*len(signal) # background
+    if model == 'rician':
+        var1 = n_level1*n_level1; var2 = n_level2*n_level2
+        for start, stop in rows: level[start:stop] = [sqrt(var1+var2*f*f) for f in signal[start:stop]]
+        return (array('f', [s*n for s, n in zip(level, bank.draw())]),
+                array('f', [s*n for s, n in zip(level, bank.draw())]))
+    for start, stop in rows: level[start:stop] = [n_level1+n_level2*abs(f) for f in signal[start:stop]]
+    return array('f', [s*n for s, n in zip(level, bank.draw())])
+
+def normalize_python(signal, noise, mode):
+    # add noise and deal with negative values in one pass
+    # noise may be a (real, imaginary) tuple of channels
+    imag = None
+    if isinstance(noise, tuple): noise, imag = noise
+    if mode == 'magnitude':                                                    # Magnitude Image
+        if imag is None: data = [abs(d+n) for d, n in zip(signal, noise)]
+        else: data = [sqrt((d+n)*(d+n)+i*i) for d, n, i in zip(signal, noise, imag)]
+    else:                                                                      # Re Image: shift
+        data = [d+n for d, n in zip(signal, noise)]
+        min_ = min(data); data = [f-min_ for f in data]
+    normalization = max(data)
+    if normalization == 0: normalization = sys.float_info.min
+    return array('f', [f/normalization for f in data])
+
+def window_python(data, W, L, uint8=False):
+    # W/L, scaling to 220 and clamping --> all in one for speed
+    # (the clamping thresholds are translated back to unnormalized values)
+    a = 220./W; b = (0.5-L/W)*220.
+    lo = -b/a; hi = (220.-b)/a
+    if uint8: return bytearray([0 if f <= lo else (220 if f >= hi else int(f*a+b)) for f in data])
+    return [0. if f <= lo else (220. if f >= hi else f*a+b) for f in data]
@@ -0,0 +1,60 @@
+#
+# Noise bank
+#
+# standard normal random numbers are generated once (float32), every frame
+# takes a contiguous run starting at a random offset into the bank, instead
+# of drawing (or shuffling) a full slice of new samples
+# shifted runs of the same bank look uncorrelated on the image, the cost per
+# frame is at most one memory copy
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import random
+from array import array
+
+try: import numpy as np
+except ImportError: np = None
+
+
+class NoiseBank(object):
+    # size     samples per draw (pixels per slice)
+    # backend  'numpy' (float32 array, seeded numpy.random.Generator) or
+    #          'python' (array('f'), random.Random)
+    # seed     for reproducible noise, None for a random seed
+    # factor   bank length in multiples of size (number of distinct offsets)
+
+    def __init__(self, size, backend='numpy', seed=None, factor=4):
+        self.size = size
+        self.backend = backend
+        length = size*factor
+        self.reseed(seed)
+        if backend == 'numpy': self.bank = self.rng.standard_normal(length, dtype=np.float32) if hasattr(np.random, 'default_rng') \
+                                           else self.rng.standard_normal(length).astype(np.float32) # NumPy < 1.17
+        else: self.bank = array('f', [self.rng.gauss(0, 1) for f in range(0, length)])
+
+    def reseed(self, seed):
+        # restarts the generator of the offsets, the bank stays (e.g. reproducible
+        # noise per slice of a batch, whatever was drawn before)
+        if self.backend == 'numpy':
+            if hasattr(np.random, 'default_rng'):
+                self.rng = np.random.default_rng(seed)
+                self._randint = self.rng.integers      # high exclusive
+            else: # NumPy < 1.17
+                self.rng = np.random.RandomState(seed)
+                self._randint = self.rng.randint       # high exclusive
+        else:
+            self.rng = random.Random(seed)
+            self._randint = self.rng.randrange         # high exclusive
+
+    def offset(self):
+        # random start of the next run
+        return int(self._randint(0, len(self.bank)-self.size+1))
+
+    def draw(self, shape=None):
+        # size standard normal samples, a view into the bank for NumPy (do not modify),
+        # reshaped to shape if given; an array('f') copy for the python backend
+        start = self.offset()
+        run = self.bank[start:start+self.size]
+        if shape is not None: run = run.reshape(shape)
+        return run
@@ -0,0 +1,95 @@
+#
+# Protocol optimization on the signal equations (see physics.py)
+#
+# works on the T1/T2/PD of single tissues, no image voxels involved:
+#   null_ti      TI nulling a tissue for given TE/TR, closed form of IR = 0:
+#                  TI = T1 * ln(2 / (1 + exp(-(TR-TE)/T1)))
+#                (always <= (TR-TE)/2, so TR >= TI+TE holds by itself)
+#   null_tr      TR nulling a tissue for given TE/TI (TI < T1*ln2, NaN otherwise)
+#   grid_search  the best of a TE x TR x TI grid for a tissue pair, evaluated as
+#                broadcast arrays in chunks (a few MB at a time), protocols
+#                violating the GUI limits (TE >= 1, TR >= 2*TE+8, TR >= TI+TE)
+#                are excluded
+#   optimize     repeated grid searches, each zoomed in around the last best
+# objectives:
+#   'contrast'   signal difference of the two tissues
+#   'efficiency' contrast per square root of TR, the contrast to noise per unit
+#                time (fixed noise per excitation, averages in a given time ~ 1/TR)
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: import numpy as np
+except ImportError: np = None
+
+from .physics import ATT_array
+
+OBJECTIVES = ('contrast', 'efficiency')
+
+
+def tissue(table, name):
+    # T1, T2, PD of a tissue of a TissueTable
+    i = table.index(name)
+    return table.T1[i], table.T2[i], table.PD[i]
+
+def null_ti(T1, te, tr):
+    # TI with zero inversion recovery signal, arrays are broadcast
+    return T1*np.log(2./(1.+np.exp(-(np.asarray(tr, dtype=np.float64)-te)/T1)))
+
+def null_tr(T1, te, ti):
+    # TR with zero inversion recovery signal, NaN if TI >= T1*ln2 (no TR nulls the tissue)
+    left = 2.*np.exp(-np.asarray(ti, dtype=np.float64)/T1)-1.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(left > 0, te-T1*np.log(np.where(left > 0, left, 1.)), np.nan)
+
+def feasible(te, tr, ti):
+    # protocols within the limits of the GUI sliders (see physics.constrain)
+    return (te >= 1) & (tr >= 2*te+8) & ((ti == 0) | (tr >= ti+te))
+
+def objective(sa, sb, tr, kind='contrast', mode='magnitude'):
+    # value of the protocols for the signals sa, sb of two tissues
+    # mode  'magnitude' compares |sa| and |sb|, 'real' the signed signals
+    if mode == 'magnitude': value = np.abs(np.abs(sa)-np.abs(sb))
+    else: value = np.abs(sa-sb)
+    if kind == 'efficiency': value /= np.sqrt(tr)
+    elif kind != 'contrast': raise ValueError('unknown objective %s, not in %s' % (kind, OBJECTIVES))
+    return value
+
+def grid_search(table, a, b, te, tr, ti=0, kind='contrast', mode='magnitude', chunk=2**20):
+    # best protocol of the grid te x tr x ti (1D arrays of values) for the tissues a, b
+    # chunk  protocols evaluated at a time
+    # returns (TE, TR, TI, value), value None if no protocol of the grid is feasible
+    ta = tissue(table, a); tb = tissue(table, b)
+    te = np.atleast_1d(np.asarray(te, dtype=np.float64))
+    tr = np.atleast_1d(np.asarray(tr, dtype=np.float64))[:,np.newaxis]
+    ti = np.atleast_1d(np.asarray(ti, dtype=np.float64))[np.newaxis,:]
+    rows = max(1, chunk//(tr.size*ti.size))
+    best = (None, None, None, None)
+    for i in range(0, te.size, rows):
+        TE = te[i:i+rows,np.newaxis,np.newaxis] # (TE, TR, TI) by broadcasting
+        TR = tr[np.newaxis]; TI = ti[np.newaxis]
+        value = objective(ATT_array(ta[0], ta[1], ta[2], TE, TR, TI),
+                          ATT_array(tb[0], tb[1], tb[2], TE, TR, TI), TR, kind, mode)
+        value[~feasible(TE, TR, TI)] = -np.inf
+        j = np.unravel_index(np.argmax(value), value.shape)
+        if value[j] > -np.inf and (best[3] is None or value[j] > best[3]):
+            best = (float(te[i+j[0]]), float(tr[j[1],0]), float(ti[0,j[2]]), float(value[j]))
+    return best
+
+def optimize(table, a, b, te=(1, 250), tr=(10, 4000), ti=(0, 0), kind='contrast', mode='magnitude', steps=64, levels=4):
+    # best protocol within the (min, max) ranges of TE, TR and TI, ti=(0, 0) for
+    # spin echo only, (0, max) includes spin echo (TI=0) with inversion recovery
+    # steps grid points per range and level, every level zooms in around the best
+    ranges = [list(te), list(tr), list(ti)]
+    best = (None, None, None, None)
+    for level in range(0, levels):
+        axes = [np.linspace(lo, hi, steps) if hi > lo else np.array([lo]) for lo, hi in ranges]
+        found = grid_search(table, a, b, axes[0], axes[1], axes[2], kind, mode)
+        if found[3] is None: break
+        best = found
+        # two grid steps around the best, within the original limits
+        limits = [te, tr, ti]
+        for n, (lo, hi) in enumerate(ranges):
+            step = (hi-lo)/(steps-1.) if hi > lo else 0.
+            ranges[n] = [max(limits[n][0], best[n]-2*step), min(limits[n][1], best[n]+2*step)]
+    return best
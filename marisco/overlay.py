@@ -0,0 +1,111 @@
+#
+# Colour overlay of the RGBA tissue pages (MaRISCo-X start screen)
+#
+# the overlay used to be a chain of ~20 PIL passes (paste with the brain mask,
+# invert, Image.blend, ImageEnhance.Contrast/Brightness), colorize runs the same
+# chain as NumPy operations on the 8 bit channels of the page, with the integer
+# arithmetic of PIL at every stage (paste rounds, blend truncates and clips,
+# Contrast blends with the rounded mean), so the result is that of colorize_pil
+# without the Image objects and split/paste passes, the GUI caches it per slice
+# without NumPy colorize_pil runs the original chain
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import sys
+
+try: import numpy as np
+except ImportError: np = None
+try: from PIL import Image, ImageOps, ImageEnhance
+except ImportError: Image = None
+
+
+def _paste(channel, mask):
+    # Image.new('L', size, 0).paste(channel, mask): channel*mask/255, rounded as PIL
+    tmp = channel.astype(np.int32)*mask+128
+    return ((tmp >> 8)+tmp) >> 8
+
+def _blend(a, b, alpha):
+    # Image.blend of 8 bit channels: a+alpha*(b-a) in float32, truncated, clipped
+    # when extrapolating (alpha outside 0..1)
+    alpha = np.float32(alpha)
+    out = a.astype(np.float32)+alpha*(b-a).astype(np.float32)
+    if alpha < 0 or alpha > 1: np.clip(out, 0., 255., out=out)
+    return out.astype(np.int32)
+
+def _contrast(a, factor):
+    # ImageEnhance.Contrast: blend with the image mean, rounded
+    mean = int(a.mean(dtype=np.float64)+0.5)
+    return _blend(np.full_like(a, mean), a, factor)
+
+def colorize(image):
+    # RGBA page (R/G/B = CSF/GM/WM inside the A mask, muscle/fat/bone outside) to an RGB overlay
+    if np is None: return colorize_pil(image)
+    data = np.asarray(image.convert('RGBA')).astype(np.int32)
+    mask = data[:,:,3]
+    # brain
+    R1, G1, B1 = [255-_paste(data[:,:,i], mask) for i in range(0, 3)] # CSF GM WM
+    # non-brain
+    R2, G2, B2 = [255-_paste(data[:,:,i], 255-mask) for i in range(0, 3)] # muscle fat bone
+    # mix colors non-brain
+    B2 = _contrast(B2, 0.3)
+    R2 = _blend(np.zeros_like(R2), R2, 0.4) # Brightness
+    R2 = _blend(R2, G2, 0.5); R3 = _contrast(R2, 2)
+    G2 = _blend(G2, B2, 0.5)
+    G3 = _contrast(_blend(G2, R2, 0.5), 2)
+    B3 = _contrast(_blend(B2, R2, 0.5), 2)
+    R3 = _contrast(_blend(R3, B3, 0.5), 2)
+    G3 = _contrast(_blend(G3, B3, 0.5), 2)
+    # join brain - non-brain
+    R4 = _contrast(_blend(R1, R3, 0.5), 2)
+    G4 = _contrast(_blend(G1, G3, 0.5), 2)
+    B4 = _contrast(_blend(B1, B3, 0.5), 2)
+    return Image.fromarray((255-np.dstack([R4, G4, B4])).astype(np.uint8), 'RGB')
+
+def colorize_pil(image):
+    # the PIL chain
+    # brain
+    mask = image.split()[3]
+    R1 = Image.new("L", image.size, 0); R1.paste(image.split()[0], mask); R1 = ImageOps.invert(R1) # CSF
+    G1 = Image.new("L", image.size, 0); G1.paste(image.split()[1], mask); G1 = ImageOps.invert(G1) # GM
+    B1 = Image.new("L", image.size, 0); B1.paste(image.split()[2], mask); B1 = ImageOps.invert(B1) # WM
+    # non-brain
+    mask = ImageOps.invert(image.split()[3])
+    R2 = Image.new("L", image.size, 0); R2.paste(image.split()[0], mask); R2 = ImageOps.invert(R2) # muscle
+    G2 = Image.new("L", image.size, 0); G2.paste(image.split()[1], mask); G2 = ImageOps.invert(G2) # fat
+    B2 = Image.new("L", image.size, 0); B2.paste(image.split()[2], mask); B2 = ImageOps.invert(B2) # bone
+    # mix colors non-brain
+    contr  = ImageEnhance.Contrast(B2);   B2 = contr.enhance(0.3);
+    bright = ImageEnhance.Brightness(R2); R2 = bright.enhance(.4);
+    R2 = Image.blend(R2,G2,0.5); contr = ImageEnhance.Contrast(R2); R3 = contr.enhance(2);
+    G2 = Image.blend(G2,B2,0.5); contr = ImageEnhance.Contrast(G2); G3 = contr.enhance(2);
+    G3 = Image.blend(G2,R2,0.5); contr = ImageEnhance.Contrast(G3); G3 = contr.enhance(2);
+    B3 = Image.blend(B2,R2,0.5); contr = ImageEnhance.Contrast(B3); B3 = contr.enhance(2);
+    R3 = Image.blend(R3,B3,0.5); contr = ImageEnhance.Contrast(R3); R3 = contr.enhance(2);
+    G3 = Image.blend(G3,B3,0.5); contr = ImageEnhance.Contrast(G3); G3 = contr.enhance(2);
+    # join brain - non-brain
+    R4 = Image.blend(R1,R3,0.5); contr = ImageEnhance.Contrast(R4); R4 = contr.enhance(2)
+    G4 = Image.blend(G1,G3,0.5); contr = ImageEnhance.Contrast(G4); G4 = contr.enhance(2)
+    B4 = Image.blend(B1,B3,0.5); contr = ImageEnhance.Contrast(B4); B4 = contr.enhance(2)
+    return ImageOps.invert(Image.merge('RGB', (R4,G4,B4)))
+
+
+def main(argv=None):
+    # test: colorize against colorize_pil on every page of an RGBA TIF
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m marisco.overlay', description='compare colorize with the PIL chain (colorize_pil) page by page')
+    parser.add_argument('filename', help='RGBA TIF, e.g. RGBA.tif of MaRISCo-X')
+    args = parser.parse_args(argv)
+    img = Image.open(args.filename)
+    worst = 0
+    for i in range(0, getattr(img, 'n_frames', 1)):
+        img.seek(i)
+        page = img.convert('RGBA')
+        diff = np.abs(np.asarray(colorize(page), dtype=np.int32)-np.asarray(colorize_pil(page), dtype=np.int32)).max()
+        if diff: print('page %d: up to %d levels off' % (i, diff))
+        worst = max(worst, diff)
+    print('%s: %d pages, largest difference %d' % (args.filename, i+1, worst))
+    return 1 if worst else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
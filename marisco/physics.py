@@ -0,0 +1,54 @@
+#
+# MR signal equations used by the simulation
+#
+#   SE = PD * exp(-TE/T2) * (1 - exp(-(TR-TE)/T1))
+#   IR = PD * exp(-TE/T2) * (1 - 2*exp(-TI/T1) + exp(-(TR-TE)/T1))
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import sys
+from math import exp
+
+try: import numpy as np
+except ImportError: np = None
+
+
+def ATT(T1, T2, PD, TE, TR, TI):
+    # convert to float to avoid rounding errors
+    T1 = float(T1); T2 = float(T2); PD = float(PD)
+    TE = float(TE); TR = float(TR); TI = float(TI)
+    # just for safety (negative values should never actually occur)
+    T1 = abs(T1); T2 = abs(T2); PD = abs(PD)
+    TE = abs(TE); TR = abs(TR); TI = abs(TI)
+    # avoid division by zero
+    if T1 == 0: T1 = sys.float_info.min
+    if T2 == 0: T2 = sys.float_info.min
+    # calculate and return value
+    if TI == 0: return PD * exp(-TE/T2) * (1-exp(-(TR-TE)/T1))
+    else: return PD * exp(-TE/T2) * (1-2*exp(-TI/T1)+exp(-(TR-TE)/T1))
+
+
+def ATT_array(T1, T2, PD, TE, TR, TI):
+    # vectorized version of ATT, all arguments are broadcast against each other
+    # e.g. tissues along one axis and protocols along the other (requires NumPy)
+    T1 = np.abs(np.asarray(T1, dtype=np.float64)); T2 = np.abs(np.asarray(T2, dtype=np.float64))
+    PD = np.abs(np.asarray(PD, dtype=np.float64))
+    TE = np.abs(np.asarray(TE, dtype=np.float64)); TR = np.abs(np.asarray(TR, dtype=np.float64))
+    TI = np.abs(np.asarray(TI, dtype=np.float64))
+    # avoid division by zero
+    T1 = np.where(T1 == 0, sys.float_info.min, T1)
+    T2 = np.where(T2 == 0, sys.float_info.min, T2)
+    # SE for TI==0, IR otherwise
+    E1 = np.exp(-(TR-TE)/T1)
+    recovery = np.where(TI == 0, 1-E1, 1-2*np.exp(-TI/T1)+E1)
+    return PD * np.exp(-TE/T2) * recovery
+
+
+def constrain(TE, TR, TI):
+    # the limits of the GUI sliders: TE >= 1, TR >= 2*TE+8 and for inversion
+    # recovery TR >= TI+TE, violations are resolved by raising TE or TR
+    TE = max(TE, 1)
+    TR = max(TR, 2*TE+8)
+    if TI > 0: TR = max(TR, TI+TE)
+    return TE, TR, TI
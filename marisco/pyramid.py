@@ -0,0 +1,56 @@
+#
+# Downsampled tissue fractions for fast previews
+#
+# PyramidSource presents a source at 1/factor of its resolution (means of
+# factor x factor voxel blocks, the edges padded with zeros), the GUIs render
+# from it while a slider is dragged and refine at full resolution once idle
+# slices are downsampled on first use and kept (one slice of the source read,
+# ~1 ms for 256x256 voxels), so loading doesn't touch the volume (the basis
+# may be a memory map of the NIFTI cache), the engine finds the bounding boxes
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: import numpy as np
+except ImportError: np = None
+
+
+def block_mean(fractions, factor):
+    # (..., Y, X) to (..., ceil(Y/factor), ceil(X/factor)) float32 block means
+    y, x = fractions.shape[-2:]
+    pad_y = -y % factor; pad_x = -x % factor
+    if pad_y or pad_x:
+        fractions = np.pad(fractions, [(0, 0)]*(fractions.ndim-2)+[(0, pad_y), (0, pad_x)], mode='constant')
+    shape = fractions.shape[:-2]+((y+pad_y)//factor, factor, (x+pad_x)//factor, factor)
+    return fractions.reshape(shape).mean(axis=(-3, -1), dtype=np.float32)
+
+def preview_factor(width, height):
+    # 2 up to 256x256 voxels per slice, 4 for larger images
+    return 2 if width*height <= 256*256 else 4
+
+
+class PyramidSource(object):
+    # source  the full resolution source (NumPy backend), all other attributes are passed through
+    # factor  downsampling factor, see preview_factor
+
+    def __init__(self, source, factor=2):
+        if np is None: raise ImportError('NumPy library not found, see http://www.numpy.org')
+        self.source = source
+        self.factor = factor
+        self.width = -(-source.width//factor)
+        self.height = -(-source.height//factor)
+        self.pixdim = tuple([p*factor for p in source.pixdim])
+        self.basis = None  # not passed through, the full resolution volume
+        self.bboxes = None # computed per slice by the engine
+        self._slices = {}  # downsampled slices
+
+    def __getattr__(self, name):
+        # tissues, total_slices, scale, ... of the source
+        return getattr(self.source, name)
+
+    def slice(self, slice):
+        fractions = self._slices.get(slice)
+        if fractions is None:
+            fractions = block_mean(np.asarray(self.source.slice(slice), dtype=np.float32), self.factor)
+            self._slices[slice] = fractions
+        return fractions
@@ -0,0 +1,197 @@
+#
+# Render scheduling for the GUIs
+#
+# slider and mouse callbacks only record the latest requested state, the
+# actual rendering happens once the Tk event queue is idle (after_idle),
+# intermediate requests of a fast drag are dropped instead of replayed
+#
+# optionally the frames are computed on a background thread (RenderWorker)
+# and/or rendered progressively: a fast coarse preview per request, refined
+# once no new request came for a short time
+#
+# works with any object providing after_idle/after/after_cancel (e.g. the Tk root), Tk
+# itself is not imported here
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import sys
+
+try: import threading
+except ImportError: threading = None # excluded from the MacOS standalone builds
+try: import queue                     # Python 3
+except ImportError: import Queue as queue # Python 2
+
+
+def _keep_flags(old, kwargs):
+    # boolean keyword arguments that were True for a dropped request stay True
+    for key, value in old.items():
+        if value is True and kwargs.get(key) is False: kwargs[key] = True
+
+
+class RenderScheduler(object):
+    # widget   object providing after_idle(callback), e.g. the Tk root
+    # render   function called with the arguments of the latest request
+    # refine   optional function called with the arguments of the last rendered
+    #          request once there was no new request for idle_ms (progressive
+    #          rendering: render shows a coarse preview, refine the final image)
+    # idle_ms
+    # delay_ms if given, requests are rendered at most every delay_ms (after) instead
+    #          of once the event queue is idle (after_idle), e.g. the display rate
+
+    def __init__(self, widget, render, refine=None, idle_ms=200, delay_ms=None):
+        self.widget = widget
+        self.render = render
+        self.refine = refine
+        self.idle_ms = idle_ms
+        self.delay_ms = delay_ms
+        self.pending = None    # (args, kwargs) of the latest request, not yet rendered
+        self.scheduled = False # a render is queued with after_idle
+        self._last = None      # (args, kwargs) rendered but not refined yet
+        self._timer = None     # after id of the pending refine
+        # counters
+        self.requested = 0
+        self.rendered = 0
+        self.dropped = 0
+        self.refined = 0
+
+    def request(self, *args, **kwargs):
+        # replaces any pending request, boolean keyword arguments that were
+        # True for a dropped request stay True (e.g. recalc_noise)
+        self.requested += 1
+        if self.pending is not None:
+            self.dropped += 1
+            _keep_flags(self.pending[1], kwargs)
+        self.pending = (args, kwargs)
+        if not self.scheduled:
+            self.scheduled = True
+            if self.delay_ms is None: self.widget.after_idle(self._run)
+            else: self.widget.after(self.delay_ms, self._run)
+
+    def flush(self):
+        # render a pending request right away
+        if self.pending is None: return
+        args, kwargs = self.pending
+        self.pending = None
+        self.rendered += 1
+        self.render(*args, **kwargs)
+        if self.refine is None: return
+        # restart the idle timer, flags stay True until refined (as for dropped requests)
+        if self._last is not None: _keep_flags(self._last[1], kwargs)
+        self._last = (args, kwargs)
+        if self._timer is not None: self.widget.after_cancel(self._timer)
+        self._timer = self.widget.after(self.idle_ms, self._refine)
+
+    def cancel(self):
+        # forget the pending request and a pending refine
+        self.pending = None
+        self._last = None
+        if self._timer is not None:
+            self.widget.after_cancel(self._timer)
+            self._timer = None
+
+    def _run(self):
+        self.scheduled = False
+        self.flush()
+
+    def _refine(self):
+        self._timer = None
+        args, kwargs = self._last
+        self._last = None
+        self.refined += 1
+        self.refine(*args, **kwargs)
+
+    def stats(self):
+        return {'requested': self.requested, 'rendered': self.rendered, 'dropped': self.dropped,
+                'refined': self.refined}
+
+
+class RenderWorker(object):
+    # computes frames on a background thread, NumPy releases the GIL for the
+    # heavy array operations so the Tk main loop stays responsive
+    # widget   object providing after(ms, callback), e.g. the Tk root
+    # compute  function called (on the worker thread) with the request arguments,
+    #          must not touch Tk
+    # display  function called (on the Tk thread) with the result of the
+    #          latest request
+    # every request gets a new generation, results of older generations are
+    # discarded; results are picked up by polling with after, Tk is only
+    # called from its own thread
+
+    poll_ms = 10
+
+    def __init__(self, widget, compute, display):
+        if threading is None: raise ImportError('threading module not available')
+        self.widget = widget
+        self.compute = compute
+        self.display = display
+        self.generation = 0
+        self._job = None            # (generation, args, kwargs) waiting for the worker
+        self._results = queue.Queue()
+        self._busy = 0              # requests not yet picked up by _poll
+        self._polling = False       # a _poll is scheduled, at most one chain of polls
+        self._cond = threading.Condition()
+        self.lock = threading.Lock() # held while computing, for direct calls from the Tk thread
+        # counters
+        self.requested = 0
+        self.rendered = 0
+        self.discarded = 0
+        thread = threading.Thread(target=self._loop, name='RenderWorker')
+        thread.daemon = True
+        thread.start()
+
+    def request(self, *args, **kwargs):
+        # as RenderScheduler.request, a job the worker did not start yet is replaced
+        with self._cond:
+            self.requested += 1
+            self.generation += 1
+            if self._job is not None:
+                _keep_flags(self._job[2], kwargs)
+                self._busy -= 1
+            self._job = (self.generation, args, kwargs)
+            self._busy += 1
+            if not self._polling:
+                self._polling = True
+                self.widget.after(self.poll_ms, self._poll)
+            self._cond.notify()
+
+    def cancel(self):
+        # drops the waiting job and discards the results of all earlier requests,
+        # e.g. when a preview was shown directly from the Tk thread
+        with self._cond:
+            self.generation += 1
+            if self._job is not None:
+                self._job = None
+                self._busy -= 1
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._job is None: self._cond.wait()
+                generation, args, kwargs = self._job
+                self._job = None
+            try:
+                with self.lock: result = (self.compute(*args, **kwargs), None)
+            except Exception: result = (None, sys.exc_info()[1])
+            self._results.put((generation, result))
+
+    def _poll(self):
+        # runs on the Tk thread
+        try:
+            while True:
+                try: generation, (result, error) = self._results.get_nowait()
+                except queue.Empty: break
+                with self._cond: self._busy -= 1
+                if generation != self.generation:
+                    self.discarded += 1
+                    continue
+                if error is not None: raise error # reported by Tk like any callback error
+                self.rendered += 1
+                self.display(result)
+        finally:
+            with self._cond:
+                if self._busy > 0: self.widget.after(self.poll_ms, self._poll)
+                else: self._polling = False
+
+    def stats(self):
+        return {'requested': self.requested, 'rendered': self.rendered, 'discarded': self.discarded}
@@ -0,0 +1,107 @@
+#
+# Sequence registry, the signal equations beyond spin echo / inversion recovery
+#
+# every sequence is a function f(T1, T2, PD, TE, TR, TI, **params) vectorized
+# as ATT_array (arrays broadcast against each other, NumPy), evaluated once per
+# frame on the tissue columns, the images are then the same tissue contraction
+# for every sequence (see kernels.combine), so sequences don't add per voxel work
+#
+#   SE     spin echo, inversion recovery for TI > 0 (ATT_array)
+#   GRE    spoiled gradient echo (FLASH), flip angle and T2* (1/T2* = 1/T2 + R2')
+#            PD * sin(a)*(1-E1)/(1-cos(a)*E1) * exp(-TE/T2*)
+#   bSSFP  balanced steady state free precession, on resonance, TE = TR/2
+#            PD * sin(a)*(1-E1)/(1-(E1-E2)*cos(a)-E1*E2) * exp(-TR/(2*T2))
+#   MESE   multi-echo spin echo (CPMG), TE is the echo spacing, the image of one
+#          echo or the mean of the echo train, recovery after the last echo
+# (E1 = exp(-TR/T1), E2 = exp(-TR/T2))
+#
+# params lists the additional parameters of a sequence as the GUI sliders
+# (name, label, from, to, resolution, default), uses the sliders of TE/TR/TI
+# it reads (with their label), register adds sequences
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import sys
+from collections import OrderedDict
+
+try: import numpy as np
+except ImportError: np = None
+
+from .physics import ATT_array
+
+
+def _tissue(T1, T2, PD):
+    # absolute values, zero relaxation times replaced (avoid division by zero, as ATT)
+    T1 = np.abs(np.asarray(T1, dtype=np.float64)); T2 = np.abs(np.asarray(T2, dtype=np.float64))
+    T1 = np.where(T1 == 0, sys.float_info.min, T1)
+    T2 = np.where(T2 == 0, sys.float_info.min, T2)
+    return T1, T2, np.abs(np.asarray(PD, dtype=np.float64))
+
+def spin_echo(T1, T2, PD, TE, TR, TI):
+    return ATT_array(T1, T2, PD, TE, TR, TI)
+
+def gradient_echo(T1, T2, PD, TE, TR, TI, flip=30., R2p=20.):
+    # flip angle in degrees, R2' in 1/s
+    T1, T2, PD = _tissue(T1, T2, PD)
+    a = np.radians(flip)
+    E1 = np.exp(-np.abs(TR)/T1)
+    R2s = 1./T2+R2p/1000. # 1/ms
+    return PD*np.sin(a)*(1.-E1)/(1.-np.cos(a)*E1)*np.exp(-np.abs(TE)*R2s)
+
+def balanced_ssfp(T1, T2, PD, TE, TR, TI, flip=50.):
+    T1, T2, PD = _tissue(T1, T2, PD)
+    a = np.radians(flip)
+    TR = np.abs(TR)
+    E1 = np.exp(-TR/T1); E2 = np.exp(-TR/T2)
+    return PD*np.sin(a)*(1.-E1)/(1.-(E1-E2)*np.cos(a)-E1*E2)*np.exp(-TR/(2.*T2))
+
+def multi_echo(T1, T2, PD, TE, TR, TI, echoes=8, echo=0):
+    # echoes  echo train length, echo  the echo shown (1..echoes), 0 for the mean of the train
+    T1, T2, PD = _tissue(T1, T2, PD)
+    TE = np.abs(TE)
+    echoes = max(int(echoes), 1)
+    recovery = 1.-np.exp(-np.maximum(np.abs(TR)-echoes*TE, 0.)/T1)
+    if echo > 0: decay = np.exp(-min(int(echo), echoes)*TE/T2)
+    else: # geometric series q+q^2+...+q^N over N, q = exp(-TE/T2)
+        q = np.exp(-TE/T2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            decay = np.where(q < 1., q*(1.-q**echoes)/(echoes*np.where(q < 1., 1.-q, 1.)), q)
+    return PD*decay*recovery
+
+
+class Sequence(object):
+    # name      registry key
+    # function  f(T1, T2, PD, TE, TR, TI, **params), vectorized
+    # uses      {'TE': label, ...} of the TE/TR/TI sliders the sequence reads
+    # params    [(name, label, from, to, resolution, default)] additional parameters
+
+    def __init__(self, name, function, uses, params=()):
+        self.name = name
+        self.function = function
+        self.uses = uses
+        self.params = list(params)
+
+    def defaults(self):
+        return dict([(p[0], p[5]) for p in self.params])
+
+    def attenuation(self, table, te, tr, ti, params=None):
+        # attenuation factors of the tissues of a TissueTable (n_tissues,)
+        values = self.defaults()
+        if params: values.update(params)
+        return self.function(table.T1, table.T2, table.PD, te, tr, ti, **values)
+
+
+SEQUENCES = OrderedDict()
+
+def register(sequence):
+    SEQUENCES[sequence.name] = sequence
+    return sequence
+
+register(Sequence('SE', spin_echo, {'TE': 'TE', 'TR': 'TR', 'TI': 'TI'}))
+register(Sequence('GRE', gradient_echo, {'TE': 'TE', 'TR': 'TR'},
+                  [('flip', 'FA', 1, 90, 1, 30), ('R2p', "R2'", 0, 100, 1, 20)]))
+register(Sequence('bSSFP', balanced_ssfp, {'TR': 'TR'},
+                  [('flip', 'FA', 1, 90, 1, 50)]))
+register(Sequence('MESE', multi_echo, {'TE': 'ESP', 'TR': 'TR'},
+                  [('echoes', 'ETL', 1, 32, 1, 8), ('echo', 'Echo', 0, 32, 1, 0)]))
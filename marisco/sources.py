@@ -0,0 +1,225 @@
+#
+# Tissue fraction sources, the segmented images the simulation is based on
+#
+#   NiftiSource - GM/WM/CSF NIFTI files (requires NumPy and NiBabel)
+#   TiffSource  - multi-page RGB or RGBA TIF (requires NumPy and PIL)
+#   PilSource   - multi-page RGB or RGBA TIF, slice by slice (PIL, NumPy optional)
+#
+# every source provides
+#   tissues      TissueTable (see tissues.py) in the order slices are returned
+#   width        image width  (X, number of columns)
+#   height       image height (Y, number of rows)
+#   total_slices number of slices
+#   pixdim       (x, y) pixel size in mm
+#   scale        factor to convert the stored values into fractions of 1.0
+#   slice(n)     per tissue fractions of slice n (1 based, as the GUI slider)
+#
+# the NumPy sources keep all fractions in one contiguous float32 tensor
+#   basis        shape (n_tissues, Z, Y, X), slice(n) is basis[:,n-1]
+#                (None for a lazy NiftiSource until its cache is written)
+#   bboxes       (Z, 4) per slice bounding boxes (y0, y1, x0, x1) of the voxels
+#                with any tissue, if known at load time (see slice_bboxes)
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+from array import array
+
+try: import threading
+except ImportError: threading = None # excluded from the MacOS standalone builds
+try: import numpy as np
+except ImportError: np = None
+try: import nibabel as nib
+except ImportError: nib = None
+
+from .tissues import CHANNELS, BRAIN_TISSUES
+from .tiffstore import TiffStore
+from .cachedir import cache_file
+
+
+def tif_info(img):
+    # image dimensions and pixel size (mm) of a PIL TIF image
+    try: # prefer to read directly the TIF tags
+        width  = img.tag.tags[256][0]
+        height = img.tag.tags[257][0]
+    except: # if not present (depends on PIL/pillow implementation)
+        width, height = img.size
+    try: # prefer to read directly the TIF tags
+        x_resolution = img.tag.tags[282]  # in DPI
+        y_resolution = img.tag.tags[283]  # in DPI
+        pixdim_x = float(x_resolution[0][1])/float(x_resolution[0][0])
+        pixdim_y = float(y_resolution[0][1])/float(y_resolution[0][0])
+    except: # if not present (depends on PIL/pillow implementation)
+        pixdim_x, pixdim_y = img.info['resolution']
+        pixdim_x = 1/float(pixdim_x)
+        pixdim_y = 1/float(pixdim_y)
+    return width, height, (pixdim_x, pixdim_y)
+
+
+def split_tissues(channels, tissues, scale):
+    # (C,Z,Y,X) TIF channels to the (n_tissues,Z,Y,X) float32 basis tensor
+    # following the channel and mask columns of the tissue table
+    basis = np.empty((len(tissues),)+channels.shape[1:], dtype=np.float32)
+    if 'inside' in tissues.masks or 'outside' in tissues.masks:
+        mask = channels[CHANNELS.index('A')]*np.float32(scale) # normalize mask to 1
+    for i, (channel, rule) in enumerate(zip(tissues.channels, tissues.masks)):
+        np.multiply(channels[CHANNELS.index(channel)], scale, out=basis[i], casting='unsafe')
+        if rule == 'inside': basis[i] *= mask
+        elif rule == 'outside': basis[i] *= 1.0-mask # e.g. non-brain tissues
+    return basis
+
+
+def slice_bboxes(basis):
+    # (Z, 4) bounding boxes (y0, y1, x0, x1) of the voxels with any tissue, (0,0,0,0) if empty
+    tissue = np.any(basis, axis=0) # (Z,Y,X)
+    rows = tissue.any(axis=2); cols = tissue.any(axis=1)
+    height = rows.shape[1]; width = cols.shape[1]
+    bboxes = np.array([rows.argmax(axis=1), height-rows[:,::-1].argmax(axis=1),
+                       cols.argmax(axis=1), width-cols[:,::-1].argmax(axis=1)]).T
+    bboxes[~rows.any(axis=1)] = 0
+    return bboxes
+
+
+class NiftiSource(object):
+    # lazy   slices are read on demand through the nibabel array proxies (only the
+    #        headers are read at startup), and an uncompressed float32 cache of the
+    #        basis tensor is memory-mapped once available
+    #        lazy=False reads all volumes into memory
+    # cache  write the cache (GM_WM_CSF-<hash>.basis.npy in the user cache directory,
+    #        see cachedir.py) in the background if missing or outdated
+
+    def __init__(self, resourcedir, tissues=BRAIN_TISSUES, lazy=True, cache=True):
+        self.tissues = tissues
+        self.scale = 1.0
+        self.filenames = [os.path.join(resourcedir, name+'.nii.gz') for name in tissues.names]
+        self.images = [nib.load(filename) for filename in self.filenames] # headers only
+        image = self.images[0] # extract infos from the first tissue
+        self.pixdim = tuple(image.header.get_zooms()[:2])
+        self.width, self.height, self.total_slices = image.shape[:3]
+        self.shape = (len(tissues), self.total_slices, self.height, self.width)
+        self.cache_file = cache_file(os.path.join(resourcedir, '_'.join(tissues.names)), '.basis.npy')
+        self.basis = None
+        self.bboxes = None # only with the volumes in memory, otherwise computed per slice by the engine
+        self._thread = None # writing the cache
+        if not lazy:
+            self.basis = self.read_basis()
+            self.bboxes = slice_bboxes(self.basis)
+        elif self._cache_valid(): self.basis = np.load(self.cache_file, mmap_mode='r')
+        elif cache and threading is not None:
+            thread = threading.Thread(target=self.write_cache, name='NiftiSource')
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+
+    @staticmethod
+    def _volume(data):
+        # (X,Y,Z) to (Z,Y,X), flip AP and reverse slice order
+        return data.transpose(2, 1, 0)[::-1,::-1,:]
+
+    def read_basis(self, out=None):
+        # one contiguous (n_tissues,Z,Y,X) tensor, every slice a contiguous block
+        if out is None: out = np.empty(self.shape, dtype=np.float32)
+        for i, filename in enumerate(self.filenames):
+            out[i] = self._volume(np.asanyarray(nib.load(filename).dataobj))
+        return out
+
+    def _cache_valid(self):
+        try:
+            if os.path.getmtime(self.cache_file) < max([os.path.getmtime(f) for f in self.filenames]): return False
+            cached = np.load(self.cache_file, mmap_mode='r')
+            return cached.shape == self.shape and cached.dtype == np.float32
+        except (IOError, OSError, ValueError): return False
+
+    def write_cache(self):
+        # decompress once into the memory-mappable cache file, then switch to it
+        tmp = self.cache_file+'.tmp'
+        try:
+            out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=self.shape)
+            self.read_basis(out)
+            out.flush(); del out
+            if os.path.exists(self.cache_file): os.remove(self.cache_file)
+            os.rename(tmp, self.cache_file)
+        except (IOError, OSError): return # e.g. read only installation, stay with the proxies
+        self.basis = np.load(self.cache_file, mmap_mode='r')
+
+    def wait_basis(self):
+        # the basis tensor before passes over all slices (e.g. simulate_volume), which
+        # would decompress the volumes once per slice through the proxies: waits for
+        # the cache being written, reads the volumes into memory if there is none
+        if self._thread is not None: self._thread.join()
+        if self.basis is None:
+            self.basis = self.read_basis()
+            self.bboxes = slice_bboxes(self.basis)
+        return self.basis
+
+    def slice(self, slice):
+        # (n_tissues,Y,X), to be displayed as image rows
+        basis = self.basis
+        if basis is not None: return basis[:,slice-1]
+        z = self.total_slices-slice # only this slice is read from the files
+        return np.array([np.asanyarray(image.dataobj[:,:,z]).T[::-1] for image in self.images], dtype=np.float32)
+
+
+class TiffSource(object):
+
+    def __init__(self, filename, tissues=BRAIN_TISSUES, scale=1/255., cache=True):
+        self.tissues = tissues
+        self.scale = 1.0 # applied while building the basis tensor
+        store = TiffStore(filename, cache)
+        self.width, self.height, self.pixdim = tif_info(store.img)
+        # all pages (Z,Y,X,C) to (C,Z,Y,X) and reverse slice order
+        channels = store.array().transpose(3, 0, 1, 2)[:,::-1]
+        self.basis = split_tissues(channels, tissues, scale)
+        self.bboxes = slice_bboxes(self.basis)
+        self.total_slices = self.basis.shape[1]
+
+    def slice(self, slice):
+        return self.basis[:,slice-1]
+
+
+class PilSource(object):
+    # reads one slice at a time from the TIF
+    # tissues are separated following the channel and mask columns of the tissue table
+    # backend 'numpy': slices as (n_tissues,Y,X) float32 fractions (default if available)
+    #         'python': slices as array('f') of the stored values, no NumPy required
+    # cache   use (and create) the uncompressed page cache (see tiffstore.py)
+
+    def __init__(self, filename, tissues=BRAIN_TISSUES, scale=1/255., backend=None, cache=True):
+        if backend is None: backend = 'numpy' if np is not None else 'python'
+        self.backend = backend
+        self.tissues = tissues
+        self.scale = scale if backend == 'python' else 1.0 # NumPy slices are already scaled
+        self.channel_scale = scale
+        self.store = TiffStore(filename, cache) # pages in O(1), in any order
+        self.width, self.height, self.pixdim = tif_info(self.store.img)
+        self.total_slices = self.store.total_pages
+        self.last_slice = -1
+        self.data = None
+
+    def page(self, slice):
+        # the (colour) TIF page of the slice
+        return self.store.page(self.total_slices-slice)
+
+    def slice(self, slice):
+        if slice == self.last_slice: return self.data
+        if self.backend == 'numpy':
+            channels = self.store.array(self.total_slices-slice).transpose(2, 0, 1)[:,np.newaxis] # (C,1,Y,X)
+            self.data = split_tissues(channels, self.tissues, self.channel_scale)[:,0]
+        else: self.data = self._split(slice)
+        self.last_slice = slice
+        return self.data
+
+    def _split(self, slice):
+        channels = [array('f', c.getdata()) for c in self.page(slice).split()]
+        if 'inside' in self.tissues.masks or 'outside' in self.tissues.masks:
+            scale = self.channel_scale
+            mask    = [f*scale for f in channels[CHANNELS.index('A')]] # normalize mask to 1
+            invmask = [1.0-f for f in mask]                            # e.g. non-brain mask
+        data = []
+        for channel, rule in zip(self.tissues.channels, self.tissues.masks):
+            frac = channels[CHANNELS.index(channel)]
+            if rule == 'inside': frac = array('f', [f*m for f, m in zip(frac, mask)])
+            elif rule == 'outside': frac = array('f', [f*m for f, m in zip(frac, invmask)])
+            data.append(frac)
+        return data
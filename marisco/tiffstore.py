@@ -0,0 +1,139 @@
+#
+# Random access to the pages of a multi-page TIF
+#
+# the IFD chain is walked once (plain struct reads, nothing is decoded), which
+# gives the number of pages and the offsets of every page, pages are then
+# read in O(1) in any order:
+#   - from an uncompressed page cache (all pages decoded once, written to the
+#     user cache directory, see cachedir.py, memory-mapped with NumPy)
+#   - directly from the strips for uncompressed 8 bit TIFs
+#   - otherwise decoded by PIL, seeking to the indexed page
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+import os
+import struct
+
+try: import numpy as np
+except ImportError: np = None
+try: from PIL import Image
+except ImportError: Image = None
+
+from .cachedir import cache_file
+
+MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'} # samples per pixel (8 bit) to PIL mode
+TYPES = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'} # TIF field types used for the tags read here
+
+
+def read_ifds(filename):
+    # tags of every IFD of a (little or big endian) TIF, as list of {tag: values}
+    # only the integer tags (BYTE/SHORT/LONG) are decoded, other values are skipped
+    ifds = []
+    with open(filename, 'rb') as f:
+        order = f.read(2)
+        if order == b'II': endian = '<'
+        elif order == b'MM': endian = '>'
+        else: raise IOError('not a TIF file: %s' % filename)
+        magic, offset = struct.unpack(endian+'HI', f.read(6))
+        if magic != 42: raise IOError('not a TIF file (or BigTIFF): %s' % filename)
+        while offset:
+            f.seek(offset)
+            n, = struct.unpack(endian+'H', f.read(2))
+            entries = f.read(12*n)
+            tags = {}
+            for i in range(n):
+                tag, type_, count = struct.unpack(endian+'HHI', entries[12*i:12*i+8])
+                if type_ not in TYPES: continue
+                fmt = endian+'%d%s' % (count, TYPES[type_])
+                size = struct.calcsize(fmt)
+                if size <= 4: value = entries[12*i+8:12*i+8+size]
+                else:
+                    pos = f.tell()
+                    f.seek(struct.unpack(endian+'I', entries[12*i+8:12*i+12])[0])
+                    value = f.read(size)
+                    f.seek(pos)
+                tags[tag] = struct.unpack(fmt, value)
+            ifds.append(tags)
+            offset, = struct.unpack(endian+'I', f.read(4))
+    return ifds
+
+
+class TiffStore(object):
+    # filename  multi-page TIF, all pages of the same size and mode
+    # cache     use (and create) the uncompressed page cache (<name>-<hash>.raw)
+
+    def __init__(self, filename, cache=True):
+        self.filename = filename
+        self.ifds = read_ifds(filename)
+        first = self.ifds[0]
+        self.total_pages = len(self.ifds)
+        self.width = first[256][0]
+        self.height = first[257][0]
+        self.samples = first.get(277, (1,))[0]
+        self.mode = MODES.get(self.samples)
+        eight_bit = all(b == 8 for b in first.get(258, (1,)))
+        chunky = first.get(284, (1,))[0] == 1
+        # strips can be read directly
+        self.uncompressed = eight_bit and chunky and self.mode is not None and first.get(259, (1,))[0] == 1
+        self.page_bytes = self.width*self.height*self.samples
+        self.img = Image.open(filename) # PIL image, for decoding and the other tags (e.g. resolution)
+        self._raw = None    # open cache file (python)
+        self._memmap = None # memory-mapped cache (NumPy)
+        if cache and eight_bit and chunky and self.mode is not None: self._open_cache()
+
+    def _cache_name(self):
+        return cache_file(self.filename, '.raw')
+
+    def _open_cache(self):
+        # use an up to date cache file, otherwise try to write one
+        name = self._cache_name()
+        size = self.page_bytes*self.total_pages
+        try: valid = os.path.getsize(name) == size and os.path.getmtime(name) >= os.path.getmtime(self.filename)
+        except OSError: valid = False
+        if not valid:
+            try: self._write_cache(name)
+            except (IOError, OSError): return # e.g. read only installation, work without cache
+        if np is not None:
+            self._memmap = np.memmap(name, dtype=np.uint8, mode='r',
+                                     shape=(self.total_pages, self.height, self.width, self.samples))
+        else: self._raw = open(name, 'rb')
+
+    def _write_cache(self, name):
+        tmp = name+'.tmp'
+        with open(tmp, 'wb') as f:
+            for page in range(0, self.total_pages): f.write(self._decode(page).tobytes())
+        if os.path.exists(name): os.remove(name)
+        os.rename(tmp, name)
+
+    def _decode(self, page):
+        # without cache: from the strips if uncompressed, otherwise by PIL
+        if self.uncompressed:
+            tags = self.ifds[page]
+            with open(self.filename, 'rb') as f:
+                raw = []
+                for offset, count in zip(tags[273], tags[279]):
+                    f.seek(offset); raw.append(f.read(count))
+            return Image.frombytes(self.mode, (self.width, self.height), b''.join(raw)[:self.page_bytes])
+        self.img.seek(page)
+        self.img.load()
+        if self.mode is not None and self.img.mode != self.mode: return self.img.convert(self.mode)
+        return self.img
+
+    def page(self, page):
+        # PIL image of a page (0 based)
+        if self._memmap is not None:
+            return Image.frombuffer(self.mode, (self.width, self.height), self._memmap[page], 'raw', self.mode, 0, 1)
+        if self._raw is not None:
+            self._raw.seek(page*self.page_bytes)
+            return Image.frombytes(self.mode, (self.width, self.height), self._raw.read(self.page_bytes))
+        return self._decode(page)
+
+    def array(self, page=None):
+        # (Y,X,C) uint8 array of a page, or (pages,Y,X,C) of all pages (requires NumPy)
+        if self._memmap is not None:
+            return self._memmap if page is None else self._memmap[page]
+        if page is not None: return np.atleast_3d(np.asarray(self.page(page)))
+        data = np.empty((self.total_pages, self.height, self.width, self.samples), dtype=np.uint8)
+        for page in range(0, self.total_pages): data[page] = np.atleast_3d(np.asarray(self.page(page)))
+        return data
@@ -0,0 +1,91 @@
+#
+# Tissue parameter tables
+#
+# one row per tissue:
+#   name     tissue name, for NIFTI input also the file name (name.nii.gz)
+#   T1/T2    relaxation times in ms
+#   PD       proton density
+#   channel  TIF channel holding the tissue fraction (R/G/B/A)
+#   mask     'all'     use the channel as it is
+#            'inside'  only inside the mask (A channel), e.g. brain tissues
+#            'outside' only outside the mask (A channel), e.g. non-brain tissues
+#
+# tables can be read from plain text files, one tissue per line, e.g.
+#
+#   # name  T1     T2     PD    channel  mask
+#   GM      1034   93     0.78  G        all
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: import numpy as np
+except ImportError: np = None
+
+CHANNELS = ('R', 'G', 'B', 'A', '-') # '-' no TIF channel (NIFTI input only)
+MASKS = ('all', 'inside', 'outside')
+
+
+class TissueTable(object):
+
+    def __init__(self, rows):
+        self.rows = []
+        for name, T1, T2, PD, channel, mask in rows:
+            if channel not in CHANNELS: raise ValueError('unknown channel %s for tissue %s' % (channel, name))
+            if mask not in MASKS: raise ValueError('unknown mask rule %s for tissue %s' % (mask, name))
+            self.rows.append((name, float(T1), float(T2), float(PD), channel, mask))
+        self.names = [r[0] for r in self.rows]
+        self.channels = [r[4] for r in self.rows]
+        self.masks = [r[5] for r in self.rows]
+        # parameter columns, as arrays for the vectorized signal equation
+        if np is not None:
+            self.T1 = np.array([r[1] for r in self.rows])
+            self.T2 = np.array([r[2] for r in self.rows])
+            self.PD = np.array([r[3] for r in self.rows])
+        else:
+            self.T1 = [r[1] for r in self.rows]
+            self.T2 = [r[2] for r in self.rows]
+            self.PD = [r[3] for r in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        # (name, T1, T2, PD) for every tissue
+        return iter([r[:4] for r in self.rows])
+
+    def index(self, name):
+        return self.names.index(name)
+
+    @classmethod
+    def load(cls, filename):
+        rows = []
+        with open(filename) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if not line: continue
+                fields = line.replace(',', ' ').split()
+                if len(fields) == 4: fields += ['-', 'all'] # parameters only
+                if len(fields) == 5: fields += ['all']
+                rows.append(fields)
+        return cls(rows)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            f.write('# name  T1  T2  PD  channel  mask\n')
+            for row in self.rows: f.write('%s %g %g %g %s %s\n' % row)
+
+
+# predefined Tissue Parameters, taken from:
+# https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2822798/
+BRAIN_TISSUES = TissueTable([
+    ('GM',  1034., 93.,   0.78, 'G', 'all'),
+    ('WM',  660.,  73.,   0.65, 'B', 'all'),
+    ('CSF', 4000., 2470., 0.97, 'R', 'all')])
+# adapted to the higher resolution dataset of MaRISCo_Extended
+EXTENDED_TISSUES = TissueTable([
+    ('CSF',  4000., 2470., 1.0, 'R', 'inside'),
+    ('GM',   1200., 120.,  0.8, 'G', 'inside'),
+    ('WM',   660.,  73.,   0.7, 'B', 'inside'),
+    ('FAT',  260.,  230.,  1.0, 'G', 'outside'),
+    ('MSK',  870.,  55.,   0.6, 'R', 'outside'),
+    ('BONE', 6000., 5.,    0.4, 'B', 'outside')])
@@ -0,0 +1,144 @@
+#
+# Whole volume simulation, written to a NIFTI file
+#
+# simulate_volume runs one protocol over every slice of a source and writes a
+# float32 NIFTI with the affine and voxel sizes (get_zooms) of the source NIFTI
+# files (pixdim of the TIF otherwise), the file is preallocated and filled
+# through a memory map one slab of Z slices at a time, so memory stays at a
+# slab of images whatever the size of the volume
+# the noise levels refer to the maximum signal of the whole volume (a first
+# pass over the slabs, noiseless), the noise offsets are seeded per slice, the
+# same for any slab size, the scaling to 0..1 is stored as scl_slope/scl_inter
+# signal_max, simulate_slice and scaling are the steps, also of the batch
+# rendering (batch.py), whose workers fill the slices of one volume in parallel
+#
+# License GPLv3 (http://www.gnu.org/licenses)
+#
+
+try: import numpy as np
+except ImportError: np = None
+try: import nibabel as nib
+except ImportError: nib = None
+
+from .noise import NoiseBank
+from . import kernels
+
+NIFTI_OFFSET = 352 # single file NIFTI-1 without extensions
+
+
+def geometry(source):
+    # zooms and affine of the NIFTI output, as the source NIFTI files if there are any
+    images = getattr(source, 'images', None)
+    if images: return tuple(images[0].header.get_zooms()[:3]), images[0].affine
+    px, py = source.pixdim
+    return (px, py, px), np.diag([px, py, px, 1.])
+
+def create_volume(filename, source):
+    # float32 NIFTI file of the source geometry, the data is written through volume_map
+    zooms, affine = geometry(source)
+    header = nib.Nifti1Header()
+    header.set_data_dtype(np.float32)
+    header.set_data_shape((source.width, source.height, source.total_slices))
+    header.set_qform(affine, code=1)
+    header.set_sform(affine, code=1)
+    header.set_zooms(zooms) # after the forms, which set the zooms of the affine
+    header['vox_offset'] = NIFTI_OFFSET
+    with open(filename, 'wb') as f:
+        f.write(header.binaryblock)
+        f.write(b'\0'*(NIFTI_OFFSET-len(header.binaryblock))) # extension flag: none
+        f.truncate(NIFTI_OFFSET+4*source.width*source.height*source.total_slices)
+
+def volume_map(filename, source):
+    # the NIFTI data as (Z,Y,X) memory map (x runs fastest on disk)
+    shape = (source.total_slices, source.height, source.width)
+    return np.memmap(filename, dtype=np.float32, mode='r+', offset=NIFTI_OFFSET, shape=shape)
+
+def volume_index(source, slice):
+    # z of slice in the NIFTI volume, the NIFTI sources count slices backwards
+    if getattr(source, 'images', None): return source.total_slices-slice
+    return slice-1
+
+def volume_slice(source, z):
+    # slice number of z in the NIFTI volume, see volume_index
+    if getattr(source, 'images', None): return source.total_slices-z
+    return z+1
+
+def set_scaling(filename, slope, inter=0.):
+    # scl_slope/scl_inter of a NIFTI file written by create_volume
+    with open(filename, 'r+b') as f:
+        header = nib.Nifti1Header.from_fileobj(f)
+        header['scl_slope'] = slope
+        header['scl_inter'] = inter
+        f.seek(0)
+        f.write(header.binaryblock)
+
+
+def signal_max(engine, att, slices):
+    # largest |signal| (noiseless) of the slices, the level the noise of a volume refers to
+    shape = (engine.source.height, engine.source.width)
+    scratch = engine.buffer('scratch', shape)
+    signal = engine.buffer('signal', shape)
+    max_ = 0.
+    for slice in slices:
+        fractions = engine.source.slice(slice)
+        kernels.combine_numpy(att, fractions, engine.bbox(slice, fractions), signal, scratch)
+        max_ = max(max_, float(np.amax(signal)), -float(np.amin(signal)))
+    return max_
+
+def simulate_slice(engine, att, slice, max_, mode, bank, out):
+    # noisy slice into out (Y,X), magnitude or real part, not scaled, the noise
+    # levels refer to max_ (see signal_max), the work buffers are the engine's
+    shape = out.shape
+    scratch = engine.buffer('scratch', shape)
+    fractions = engine.source.slice(slice)
+    bbox = engine.bbox(slice, fractions)
+    signal = kernels.combine_numpy(att, fractions, bbox, engine.buffer('signal', shape), scratch)
+    noise = engine.buffer('noise', (2,)+shape if engine.noise_model == 'rician' else shape)
+    kernels.noise_numpy(signal, engine.hw_noise, engine.noise_model, bank, bbox, noise, scratch, max_)
+    return kernels.normalize_numpy(signal, noise, mode, out, scratch, normalize=False)
+
+def scaling(lo, hi, mode='magnitude'):
+    # scl_slope, scl_inter of the values lo..hi to 0..1 (real part shifted by scl_inter)
+    if mode != 'magnitude': inter = lo
+    else: inter = 0.
+    slope = 1./(hi-inter) if hi > inter else 1.
+    return slope, -inter*slope
+
+
+def simulate_volume(engine, filename, te, tr, ti, mode='magnitude', slab=16, seed=None, progress=None, sequence=None, params=None):
+    # NIFTI volume of the protocol te, tr, ti (engine with the NumPy backend)
+    # mode      'magnitude' or 'real' (real part, shifted to positive by scl_inter)
+    # slab      slices simulated and written at a time
+    # seed      noise seed, None for the (random) noise bank of the engine
+    # progress  called as progress(done, total) slices after every slab
+    # sequence  sequence name and params, see SimulationEngine.attenuation
+    # returns scl_slope, scl_inter (values 0..1 after scaling)
+    if engine.backend != 'numpy': raise ValueError('simulate_volume requires the NumPy backend')
+    if nib is None: raise ImportError('NiBabel library not found, see http://nipy.org/nibabel')
+    source = engine.source
+    if hasattr(source, 'wait_basis'): source.wait_basis() # not slice by slice from the .nii.gz
+    total = source.total_slices
+    shape = (source.height, source.width)
+    att = engine.attenuation(te, tr, ti, sequence, params)
+    bank = engine.noise_bank if seed is None else NoiseBank(shape[0]*shape[1], 'numpy', seed)
+    block = np.empty((slab,)+shape, dtype=np.float32)
+    # noiseless pass: the largest |signal| of the volume
+    max_ = signal_max(engine, att, [volume_slice(source, z) for z in range(0, total)])
+    # noisy slabs, streamed to the file
+    create_volume(filename, source)
+    volume = volume_map(filename, source)
+    lo = np.inf; hi = -np.inf
+    for z0 in range(0, total, slab):
+        z1 = min(z0+slab, total)
+        for z in range(z0, z1):
+            if seed is not None: bank.reseed([seed, z])
+            simulate_slice(engine, att, volume_slice(source, z), max_, mode, bank, block[z-z0])
+        data = block[:z1-z0]
+        lo = min(lo, float(np.amin(data))); hi = max(hi, float(np.amax(data)))
+        volume[z0:z1] = data[:,::-1] # rows bottom up
+        volume.flush() # written pages can be dropped
+        if progress is not None: progress(z1, total)
+    del volume
+    slope, inter = scaling(lo, hi, mode)
+    set_scaling(filename, slope, inter)
+    return slope, inter